@@ -0,0 +1,7 @@
+-- LinkKeeper: adaptive recheck scheduling for check-links
+-- Applied by scripts/linkkeeper/setup-db.sh; safe to re-run.
+
+ALTER TABLE /*_*/faw_link_archive
+    ADD COLUMN IF NOT EXISTS la_consecutive_ok SMALLINT UNSIGNED NOT NULL DEFAULT 0 AFTER la_soft_404,
+    ADD COLUMN IF NOT EXISTS la_next_check BINARY(14) DEFAULT NULL AFTER la_consecutive_ok,
+    ADD INDEX IF NOT EXISTS idx_next_check (la_next_check);
@@ -0,0 +1,5 @@
+-- LinkKeeper: payload digest of the stored WARC snapshot, for revisit dedup
+-- Applied by scripts/linkkeeper/setup-db.sh; safe to re-run.
+
+ALTER TABLE /*_*/faw_link_archive
+    ADD COLUMN IF NOT EXISTS la_r2_digest VARBINARY(64) DEFAULT NULL AFTER la_r2_size;
@@ -0,0 +1,5 @@
+-- LinkKeeper: WARC snapshots are records inside shared multi-record files
+-- Applied by scripts/linkkeeper/setup-db.sh; safe to re-run.
+
+ALTER TABLE /*_*/faw_link_archive
+    ADD COLUMN IF NOT EXISTS la_r2_offset BIGINT UNSIGNED DEFAULT NULL AFTER la_r2_key;
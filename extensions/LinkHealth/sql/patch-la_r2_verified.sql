@@ -0,0 +1,6 @@
+-- LinkKeeper: last time the WARC snapshot was confirmed current, including
+-- unchanged (revisit) captures that leave la_r2_ts pointing at the original
+-- Applied by scripts/linkkeeper/setup-db.sh; safe to re-run.
+
+ALTER TABLE /*_*/faw_link_archive
+    ADD COLUMN IF NOT EXISTS la_r2_verified BINARY(14) DEFAULT NULL AFTER la_r2_digest;
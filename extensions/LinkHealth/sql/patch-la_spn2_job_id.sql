@@ -0,0 +1,5 @@
+-- LinkKeeper: remember the SPN2 job id so poll-archive can resolve pending captures
+-- Applied by scripts/linkkeeper/setup-db.sh; safe to re-run.
+
+ALTER TABLE /*_*/faw_link_archive
+    ADD COLUMN IF NOT EXISTS la_spn2_job_id VARBINARY(64) DEFAULT NULL AFTER la_spn2_status;
@@ -0,0 +1,7 @@
+-- LinkKeeper: store HTTP validators for conditional rechecks
+-- Applied by scripts/linkkeeper/setup-db.sh; safe to re-run.
+
+ALTER TABLE /*_*/faw_link_archive
+    ADD COLUMN IF NOT EXISTS la_etag VARBINARY(255) DEFAULT NULL AFTER la_soft_404,
+    ADD COLUMN IF NOT EXISTS la_last_modified VARBINARY(64) DEFAULT NULL AFTER la_etag,
+    ADD COLUMN IF NOT EXISTS la_content_length INT UNSIGNED DEFAULT NULL AFTER la_last_modified;
@@ -14,17 +14,33 @@ CREATE TABLE IF NOT EXISTS /*_*/faw_link_archive (
     la_dead_since   BINARY(14) DEFAULT NULL,
     la_is_dead      TINYINT(1) NOT NULL DEFAULT 0,
     la_soft_404     TINYINT(1) NOT NULL DEFAULT 0,
+    la_consecutive_ok SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+    -- When the URL is next due for a check; NULL (never checked) sorts first
+    la_next_check   BINARY(14) DEFAULT NULL,
+
+    -- HTTP validators from the last full response, for conditional rechecks
+    la_etag         VARBINARY(255) DEFAULT NULL,
+    la_last_modified VARBINARY(64) DEFAULT NULL,
+    la_content_length INT UNSIGNED DEFAULT NULL,
 
     -- Archive.org state
     la_wayback_url  VARBINARY(2048) DEFAULT NULL,
     la_wayback_ts   BINARY(14) DEFAULT NULL,
     la_spn2_status  ENUM('none','pending','success','error') NOT NULL DEFAULT 'none',
+    -- SPN2 job awaiting a result; resolved by `linkkeeper.py poll-archive`
+    la_spn2_job_id  VARBINARY(64) DEFAULT NULL,
     la_spn2_last    BINARY(14) DEFAULT NULL,
 
-    -- Local WARC snapshot state
+    -- Local WARC snapshot state: the record at la_r2_offset (la_r2_size
+    -- bytes, one gzip member) in the multi-record WARC object la_r2_key
     la_r2_key       VARBINARY(512) DEFAULT NULL,
+    la_r2_offset    BIGINT UNSIGNED DEFAULT NULL,
     la_r2_ts        BINARY(14) DEFAULT NULL,
     la_r2_size      INT UNSIGNED DEFAULT NULL,
+    -- WARC-Payload-Digest of that record; unchanged pages get revisit records
+    la_r2_digest    VARBINARY(64) DEFAULT NULL,
+    -- Last capture of the URL, changed or not; drives recapture order
+    la_r2_verified  BINARY(14) DEFAULT NULL,
 
     -- Remediation state
     la_remediated   TINYINT(1) NOT NULL DEFAULT 0,
@@ -32,16 +48,28 @@ CREATE TABLE IF NOT EXISTS /*_*/faw_link_archive (
 
     -- Metadata
     la_first_seen   BINARY(14) NOT NULL,
+    -- Legacy comma-separated page list, superseded by faw_link_page.
+    -- Copied over by `linkkeeper.py migrate-page-ids`; no longer written.
     la_page_ids     BLOB DEFAULT NULL,
 
     UNIQUE KEY uk_url_hash (la_url_hash),
     KEY idx_domain (la_domain),
     KEY idx_is_dead (la_is_dead),
     KEY idx_last_checked (la_last_checked),
+    KEY idx_next_check (la_next_check),
     KEY idx_spn2_status (la_spn2_status),
     KEY idx_consecutive_failures (la_consecutive_failures)
 ) /*$wgDBTableOptions*/;
 
+-- Which wiki pages link to which archived URL (one row per pair)
+CREATE TABLE IF NOT EXISTS /*_*/faw_link_page (
+    lp_la_id        INT UNSIGNED NOT NULL,
+    lp_page_id      INT UNSIGNED NOT NULL,
+
+    PRIMARY KEY (lp_la_id, lp_page_id),
+    KEY idx_page_id (lp_page_id, lp_la_id)
+) /*$wgDBTableOptions*/;
+
 CREATE TABLE IF NOT EXISTS /*_*/faw_link_queue (
     lq_id           INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
     lq_url          VARBINARY(2048) NOT NULL,
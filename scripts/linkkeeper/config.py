@@ -19,6 +19,12 @@ def load_config():
         "db_user": os.environ.get("DB_USER", "wiki"),
         "db_password": os.environ.get("DB_PASSWORD", ""),
         "db_name": os.environ.get("DB_NAME", "flowartswiki"),
+        "db_pool_size": int(os.environ.get("DB_POOL_SIZE", "4")),
+
+        # Local state shared by LinkKeeper processes (rate limit buckets etc.)
+        "state_dir": os.environ.get("LINKKEEPER_STATE_DIR", "/var/lib/linkkeeper"),
+        # Rate limit overrides, e.g. "domain=2:1,service:spn2=0.2:1"
+        "rate_limits": os.environ.get("RATE_LIMITS", ""),
 
         # Tier 1: Internet Archive (optional)
         "ia_access_key": os.environ.get("IA_ACCESS_KEY"),
@@ -29,6 +35,10 @@ def load_config():
         "r2_access_key": os.environ.get("R2_ACCESS_KEY"),
         "r2_secret_key": os.environ.get("R2_SECRET_KEY"),
         "r2_bucket": os.environ.get("R2_BUCKET", "flowartswiki-backups"),
+        # Largest response body stored per WARC capture; longer ones are truncated
+        "warc_max_bytes": int(os.environ.get("WARC_MAX_BYTES", str(100 * 1024 * 1024))),
+        # "stream" uploads WARCs to R2 as they are written, "file" stages them on disk
+        "warc_upload_mode": os.environ.get("WARC_UPLOAD_MODE", "stream"),
 
         # Tier 3: MediaWiki bot account (optional)
         "wiki_bot_user": os.environ.get("WIKI_BOT_USER"),
@@ -1,91 +1,246 @@
 """HTTP health checks for archived URLs.
 
-Runs every 4 hours. Checks 100 URLs per batch, oldest-checked first.
-After 3 consecutive failures, marks the URL as dead.
+Runs hourly. Checks up to 1000 URLs per batch, taking only URLs whose
+la_next_check has come due (never-checked URLs first). After 3
+consecutive failures, marks the URL as dead.
+
+Rechecks are adaptive: each consecutive healthy result doubles the
+interval (1 day up to 32 days), a failing URL is rechecked after an hour
+so death is confirmed quickly, and a confirmed-dead URL is retried weekly
+in case it comes back.
+
+URLs are checked by a thread pool with one lane per domain: each domain
+has at most one request in flight, and lanes are interleaved so one slow
+host only ever ties up a single worker.
 """
 
+import time
+import heapq
+import random
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from lib.db import get_connection, execute, now_ts
+from lib.db import connection, execute, now_ts, ts_in, BatchWriter
 from lib.http_check import check_url
+from lib.ratelimit import get_limiter
+from lib.scheduler import out_of_time
 from lib.url_normalize import extract_domain
 
 logger = logging.getLogger("linkkeeper.check_links")
 
 DEAD_THRESHOLD = 3  # consecutive failures before marking dead
 
+HOUR = 3600
+HEALTHY_BASE_INTERVAL = 24 * HOUR   # first recheck after a healthy result
+HEALTHY_MAX_INTERVAL = 32 * 24 * HOUR
+FAILING_INTERVAL = 1 * HOUR         # recheck while confirming a failure
+DEAD_INTERVAL = 7 * 24 * HOUR       # retry confirmed-dead URLs weekly
+JITTER = 0.1                        # +/- fraction, spreads rechecks out
+
+FLUSH_SIZE = 200      # results per write-back flush
+FLUSH_SECONDS = 5.0   # max age of the oldest buffered result before a flush
+IDLE_SECONDS = 1.0    # how often a waiting run checks for a due flush
+
+# Fixed statement text for the write-back, run through execute_many
+# A 304 revalidation passes NULL status/validators, keeping the stored ones
+HEALTHY_SQL = """
+    UPDATE faw_link_archive SET
+        la_http_status = COALESCE(%s, la_http_status),
+        la_last_checked = %s,
+        la_consecutive_failures = 0,
+        la_is_dead = 0,
+        la_dead_since = NULL,
+        la_soft_404 = 0,
+        la_etag = COALESCE(%s, la_etag),
+        la_last_modified = COALESCE(%s, la_last_modified),
+        la_content_length = COALESCE(%s, la_content_length),
+        la_consecutive_ok = %s,
+        la_next_check = %s
+    WHERE la_id = %s
+"""
+
+FAILED_SQL = """
+    UPDATE faw_link_archive SET
+        la_http_status = %s,
+        la_last_checked = %s,
+        la_consecutive_failures = %s,
+        la_is_dead = %s,
+        la_soft_404 = %s,
+        la_dead_since = COALESCE(%s, la_dead_since),
+        la_consecutive_ok = 0,
+        la_next_check = %s
+    WHERE la_id = %s
+"""
+
 
-def run(config, batch=100):
-    """Run health checks on the oldest-checked URLs."""
-    conn = get_connection(config)
-    ts = now_ts()
-
-    rows = execute(conn, """
-        SELECT la_id, la_url, la_domain, la_consecutive_failures
-        FROM faw_link_archive
-        ORDER BY la_last_checked ASC, la_id ASC
-        LIMIT %s
-    """, (batch,))
-
-    if not rows:
-        logger.debug("No URLs to check")
-        return 0
-
-    checked = 0
-    newly_dead = 0
-
-    for row in rows:
-        la_id = row.get("la_id", row.get(b"la_id"))
-        url = row.get("la_url", row.get(b"la_url"))
-        if isinstance(url, bytes):
-            url = url.decode("utf-8", errors="replace")
-        domain = row.get("la_domain", row.get(b"la_domain"))
-        if isinstance(domain, bytes):
-            domain = domain.decode("utf-8", errors="replace")
-        prev_failures = row.get("la_consecutive_failures", row.get(b"la_consecutive_failures", 0))
-
-        result = check_url(url, domain=domain)
-
-        if result["alive"] and not result["soft_404"]:
-            # URL is healthy - reset failure counter
-            execute(conn, """
-                UPDATE faw_link_archive SET
-                    la_http_status = %s,
-                    la_last_checked = %s,
-                    la_consecutive_failures = 0,
-                    la_is_dead = 0,
-                    la_dead_since = NULL,
-                    la_soft_404 = 0
-                WHERE la_id = %s
-            """, (result["status"], ts, la_id))
-        else:
-            # URL failed
-            new_failures = prev_failures + 1
-            is_dead = 1 if new_failures >= DEAD_THRESHOLD else 0
-            soft_404 = 1 if result["soft_404"] else 0
-
-            update_fields = {
-                "la_http_status": result["status"],
-                "la_last_checked": ts,
-                "la_consecutive_failures": new_failures,
-                "la_is_dead": is_dead,
-                "la_soft_404": soft_404,
-            }
-
-            # Only set dead_since on the transition to dead
-            if is_dead and new_failures == DEAD_THRESHOLD:
-                update_fields["la_dead_since"] = ts
-                newly_dead += 1
-                logger.warning("URL confirmed dead: %s (status=%s)", url, result["status"])
-
-            set_clause = ", ".join(f"{k} = %s" for k in update_fields)
-            execute(conn, f"""
-                UPDATE faw_link_archive SET {set_clause}
-                WHERE la_id = %s
-            """, (*update_fields.values(), la_id))
-
-        checked += 1
-
-    logger.info("Checked %d URLs, %d newly dead", checked, newly_dead)
-    conn.close()
-    return checked
+def run(config, batch=1000, concurrency=8):
+    """Run health checks on the URLs that are due."""
+    with connection(config) as conn:
+        ts = now_ts()
+
+        rows = execute(conn, """
+            SELECT la_id, la_url, la_domain, la_consecutive_failures,
+                   la_consecutive_ok, la_etag, la_last_modified
+            FROM faw_link_archive
+            WHERE la_next_check IS NULL OR la_next_check <= %s
+            ORDER BY la_next_check ASC, la_id ASC
+            LIMIT %s
+        """, (ts, batch))
+
+        if not rows:
+            logger.debug("No URLs due for a check")
+            return 0
+
+        checked = 0
+        newly_dead = 0
+        not_modified = 0
+        short_circuited = 0
+
+        items = []
+        for row in rows:
+            url = row.get("la_url", row.get(b"la_url"))
+            if isinstance(url, bytes):
+                url = url.decode("utf-8", errors="replace")
+            domain = row.get("la_domain", row.get(b"la_domain"))
+            if isinstance(domain, bytes):
+                domain = domain.decode("utf-8", errors="replace")
+            items.append({
+                "la_id": row.get("la_id", row.get(b"la_id")),
+                "url": url,
+                "domain": domain,
+                "prev_failures": row.get("la_consecutive_failures", row.get(b"la_consecutive_failures", 0)),
+                "prev_ok": row.get("la_consecutive_ok", row.get(b"la_consecutive_ok", 0)),
+                "etag": _text(row.get("la_etag", row.get(b"la_etag"))),
+                "last_modified": _text(row.get("la_last_modified", row.get(b"la_last_modified"))),
+            })
+
+        # Results are buffered and flushed in groups on one transaction
+        with BatchWriter(conn, size=FLUSH_SIZE, interval=FLUSH_SECONDS) as writer:
+            for item, result in _check_all(items, concurrency, idle=writer.flush_if_due):
+                la_id = item["la_id"]
+                url = item["url"]
+                prev_failures = item["prev_failures"]
+
+                if result["alive"] and not result["soft_404"]:
+                    # URL is healthy - reset failure counter
+                    if result["not_modified"]:
+                        not_modified += 1
+                        status = None
+                    else:
+                        status = result["status"]
+                    ok_streak = min(item["prev_ok"] + 1, 1000)
+                    writer.add(HEALTHY_SQL, (
+                        status, ts,
+                        _encode(result["etag"]), _encode(result["last_modified"]),
+                        result["content_length"], ok_streak,
+                        _next_check(_healthy_interval(ok_streak)), la_id,
+                    ))
+                else:
+                    # URL failed (possibly the shared verdict of an open
+                    # domain circuit breaker, with no request made)
+                    if result["short_circuited"]:
+                        short_circuited += 1
+                    new_failures = min(prev_failures + 1, 255)
+                    is_dead = 1 if new_failures >= DEAD_THRESHOLD else 0
+                    soft_404 = 1 if result["soft_404"] else 0
+
+                    # Only set dead_since on the transition to dead
+                    dead_since = None
+                    if is_dead and new_failures == DEAD_THRESHOLD:
+                        dead_since = ts
+                        newly_dead += 1
+                        logger.warning("URL confirmed dead: %s (status=%s)", url, result["status"])
+
+                    interval = DEAD_INTERVAL if is_dead else FAILING_INTERVAL
+                    writer.add(FAILED_SQL, (
+                        result["status"], ts, new_failures, is_dead, soft_404, dead_since,
+                        _next_check(interval), la_id,
+                    ))
+
+                checked += 1
+
+        logger.info("Checked %d URLs (%d not modified, %d short-circuited), %d newly dead",
+                    checked, not_modified, short_circuited, newly_dead)
+        return checked
+
+
+def _check_all(items, concurrency, idle=None):
+    """Check items concurrently, yielding (item, result) as each finishes.
+
+    Each domain is a lane with at most one check in flight; the next URL
+    for a domain is only submitted once the previous one completes. A lane
+    whose rate-limit bucket is empty is parked until its next slot rather
+    than handed to a worker that would sleep, so workers stay busy with
+    other domains. Results are yielded on the calling thread so DB writes
+    stay on one connection; idle() is called on that thread at least every
+    IDLE_SECONDS while waiting, e.g. to flush buffered writes.
+    """
+    limiter = get_limiter()
+    lanes = {}
+    for item in items:
+        lanes.setdefault(item["domain"], deque()).append(item)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        in_flight = {}
+        parked = []  # heap of (ready_at, domain)
+
+        def submit_next(domain):
+            lane = lanes[domain]
+            if not lane or out_of_time():
+                return
+            delay = limiter.next_available(f"domain:{domain}")
+            if delay > 0:
+                heapq.heappush(parked, (time.monotonic() + delay, domain))
+                return
+            item = lane.popleft()
+            future = pool.submit(
+                check_url, item["url"], domain=item["domain"],
+                etag=item["etag"], last_modified=item["last_modified"],
+            )
+            in_flight[future] = item
+
+        # Seed one URL per domain; the executor queue interleaves the lanes
+        for domain in lanes:
+            submit_next(domain)
+
+        while in_flight or parked:
+            while parked and parked[0][0] <= time.monotonic():
+                submit_next(heapq.heappop(parked)[1])
+
+            timeout = max(0.0, parked[0][0] - time.monotonic()) if parked else None
+            if idle:
+                idle()
+                timeout = IDLE_SECONDS if timeout is None else min(timeout, IDLE_SECONDS)
+            if not in_flight:
+                time.sleep(timeout or 0)
+                continue
+
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                yield item, future.result()
+                submit_next(item["domain"])
+
+    if out_of_time():
+        logger.warning("Time budget spent, stopping early")
+
+
+def _healthy_interval(ok_streak):
+    """Exponential backoff for URLs that keep passing."""
+    return min(HEALTHY_BASE_INTERVAL * 2 ** min(ok_streak - 1, 10), HEALTHY_MAX_INTERVAL)
+
+
+def _next_check(interval):
+    """Timestamp for the next check, jittered so rechecks don't bunch up."""
+    return ts_in(interval * random.uniform(1 - JITTER, 1 + JITTER))
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
+def _encode(value):
+    return value.encode("utf-8") if isinstance(value, str) else value
@@ -0,0 +1,51 @@
+"""One-time copy of legacy la_page_ids blobs into faw_link_page.
+
+Safe to re-run: pairs are inserted with INSERT IGNORE, and the blob
+column is left in place (it is no longer written by any job).
+"""
+
+import logging
+
+from lib.db import connection, execute, execute_many
+from lib.links import parse_page_ids
+
+logger = logging.getLogger("linkkeeper.migrate_page_ids")
+
+CHUNK_SIZE = 2000  # faw_link_archive rows per keyset page
+
+
+def run(config):
+    """Copy every la_page_ids list into faw_link_page."""
+    with connection(config) as conn:
+        last_id = 0
+        scanned = 0
+        added = 0
+
+        while True:
+            rows = execute(conn, """
+                SELECT la_id, la_page_ids FROM faw_link_archive
+                WHERE la_id > %s AND la_page_ids IS NOT NULL
+                ORDER BY la_id ASC
+                LIMIT %s
+            """, (last_id, CHUNK_SIZE))
+            if not rows:
+                break
+
+            pairs = []
+            for row in rows:
+                last_id = row.get("la_id", row.get(b"la_id"))
+                raw = row.get("la_page_ids", row.get(b"la_page_ids"))
+                pairs.extend((last_id, page_id) for page_id in sorted(parse_page_ids(raw)))
+
+            if pairs:
+                added += execute_many(conn, """
+                    INSERT IGNORE INTO faw_link_page (lp_la_id, lp_page_id)
+                    VALUES (%s, %s)
+                """, pairs)
+            scanned += len(rows)
+
+            if len(rows) < CHUNK_SIZE:
+                break
+
+        logger.info("Migrated %d links, added %d page links", scanned, added)
+        return added
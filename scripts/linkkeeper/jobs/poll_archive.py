@@ -0,0 +1,142 @@
+"""Resolve pending SPN2 captures by polling their job status.
+
+Runs every 10 minutes. submit-archive leaves a row at la_spn2_status =
+'pending' with the SPN2 job id; this job asks SPN2 how those jobs went,
+STATUS_BATCH job ids per request and a few requests in flight (paced by
+the "service:spn2-status" bucket), and moves each row to 'success' with
+its Wayback URL and timestamp, or to 'error'. Jobs still pending after
+PENDING_TIMEOUT are given up on as errors so submit-archive retries them.
+"""
+
+import logging
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.db import connection, execute, now_ts, chunked, BatchWriter
+from lib.wayback import spn2_status
+from lib.lookup_cache import get_lookup_cache
+from lib.scheduler import out_of_time
+
+logger = logging.getLogger("linkkeeper.poll_archive")
+
+STATUS_BATCH = 50              # job ids per status request
+PENDING_TIMEOUT = 6 * 3600     # seconds before a still-pending job counts as failed
+
+SUCCESS_SQL = """
+    UPDATE faw_link_archive SET
+        la_wayback_url = %s,
+        la_wayback_ts = %s,
+        la_spn2_status = 'success',
+        la_spn2_job_id = NULL,
+        la_spn2_last = %s
+    WHERE la_id = %s
+"""
+
+ERROR_SQL = """
+    UPDATE faw_link_archive SET
+        la_spn2_status = 'error',
+        la_spn2_job_id = NULL,
+        la_spn2_last = %s
+    WHERE la_id = %s
+"""
+
+
+def run(config, batch=1000, concurrency=4):
+    """Poll SPN2 for pending captures and record their outcome."""
+    ia_access = config.get("ia_access_key")
+    ia_secret = config.get("ia_secret_key")
+    if not (ia_access and ia_secret):
+        logger.debug("No IA keys, nothing to poll")
+        return 0
+
+    with connection(config) as conn:
+        ts = now_ts()
+
+        # Rows submitted before job ids were stored can never be polled;
+        # hand them back to submit-archive, which checks CDX first.
+        execute(conn, """
+            UPDATE faw_link_archive SET la_spn2_status = 'none'
+            WHERE la_spn2_status = 'pending' AND la_spn2_job_id IS NULL
+        """)
+
+        rows = execute(conn, """
+            SELECT la_id, la_url, la_spn2_job_id, la_spn2_last
+            FROM faw_link_archive
+            WHERE la_spn2_status = 'pending'
+              AND la_spn2_job_id IS NOT NULL
+            ORDER BY la_spn2_last ASC, la_id ASC
+            LIMIT %s
+        """, (batch,))
+
+        if not rows:
+            logger.debug("No pending SPN2 jobs")
+            return 0
+
+        by_job = {}
+        for row in rows:
+            job_id = _text(row.get("la_spn2_job_id", row.get(b"la_spn2_job_id")))
+            by_job[job_id] = {
+                "la_id": row.get("la_id", row.get(b"la_id")),
+                "url": _text(row.get("la_url", row.get(b"la_url"))),
+                "submitted": _text(row.get("la_spn2_last", row.get(b"la_spn2_last"))),
+            }
+
+        timeout_ts = (datetime.now(timezone.utc) - timedelta(seconds=PENDING_TIMEOUT)).strftime("%Y%m%d%H%M%S")
+        cache = get_lookup_cache()
+        succeeded = failed = still_pending = 0
+
+        def poll(job_ids):
+            if out_of_time():
+                return {}
+            return spn2_status(job_ids, ia_access, ia_secret)
+
+        with BatchWriter(conn) as writer, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for statuses in pool.map(poll, chunked(list(by_job), STATUS_BATCH)):
+                for job_id, status in statuses.items():
+                    item = by_job.pop(job_id, None)
+                    if item is None:
+                        continue
+                    state = status.get("status")
+
+                    if state == "success" and status.get("timestamp"):
+                        wayback_ts = status["timestamp"]
+                        original = status.get("original_url") or item["url"]
+                        wayback_url = f"https://web.archive.org/web/{wayback_ts}/{original}"
+                        writer.add(SUCCESS_SQL, (
+                            wayback_url.encode("utf-8"), wayback_ts.encode("utf-8"),
+                            ts, item["la_id"],
+                        ))
+                        # Don't let a cached "no snapshot" outlive the capture
+                        cache.put("cdx", item["url"], {
+                            "timestamp": wayback_ts,
+                            "wayback_url": wayback_url,
+                            "status": "200",
+                        })
+                        succeeded += 1
+                    elif state == "error" or state == "success":
+                        logger.info("SPN2 job %s for %s failed: %s", job_id, item["url"],
+                                    status.get("status_ext") or status.get("message"))
+                        writer.add(ERROR_SQL, (ts, item["la_id"]))
+                        failed += 1
+                    else:
+                        by_job[job_id] = item
+
+            # Whatever is left is still pending, or SPN2 didn't answer for it
+            for job_id, item in by_job.items():
+                if item["submitted"] and item["submitted"] <= timeout_ts:
+                    logger.info("SPN2 job %s for %s still pending after %ds, giving up",
+                                job_id, item["url"], PENDING_TIMEOUT)
+                    writer.add(ERROR_SQL, (ts, item["la_id"]))
+                    failed += 1
+                else:
+                    still_pending += 1
+
+        logger.info("Polled %d SPN2 jobs: %d succeeded, %d failed, %d still pending",
+                    len(rows), succeeded, failed, still_pending)
+        return succeeded + failed
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
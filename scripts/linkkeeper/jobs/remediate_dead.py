@@ -1,16 +1,28 @@
 """Remediate confirmed-dead links in wiki pages.
 
 Runs weekly (Monday 5 AM). Two modes:
-- Auto-fix: For {{cite web}} templates, adds archive-url/archive-date/url-status=dead
+- Auto-fix: For {{cite web}}, {{cite news}} and the other CITE_TEMPLATES,
+  adds archive-url/archive-date/url-status=dead
 - Flag for review: For bare links, writes to Project:LinkKeeper/Review
+
+Work is grouped by page: pages are fetched PAGE_BATCH at a time, every
+dead URL on a page is handled together, and each page gets at most one
+edit. All API calls send maxlag and back off while the wiki is lagged.
 """
 
 import re
+import time
 import logging
 
 import requests
 
-from lib.db import get_connection, execute, now_ts
+from lib.db import connection, execute, now_ts, chunked, BatchWriter
+from lib.links import page_ids_for_links
+from lib.url_normalize import normalize_url
+from lib.snapshot_index import open_snapshot_index, HIT, MISS
+from lib.wayback import cdx_lookup
+from lib.scheduler import out_of_time
+from lib.lookup_cache import get_lookup_cache
 
 logger = logging.getLogger("linkkeeper.remediate_dead")
 
@@ -18,159 +30,381 @@ logger = logging.getLogger("linkkeeper.remediate_dead")
 MIN_DEAD_DAYS = 30
 MIN_FAILURES = 7
 
-# Regex to find {{cite web}} templates containing a specific URL
-CITE_WEB_PATTERN = re.compile(
-    r"(\{\{cite web\s*\|[^}]*?\|?\s*url\s*=\s*)(https?://[^\s|}\]]+)([^}]*\}\})",
-    re.IGNORECASE | re.DOTALL,
-)
+PAGE_BATCH = 50       # pages per pageids= query (the API's limit for bots without apihighlimits)
+MAXLAG = 5            # seconds of replication lag before the wiki turns edits away
+MAXLAG_RETRIES = 5
+MAXLAG_WAIT = 5       # seconds to wait when the wiki sends no Retry-After
 
+REVIEW_PAGE = "Project:LinkKeeper/Review"
 
-def run(config, dry_run=False):
-    """Remediate dead links with archive URLs."""
-    conn = get_connection(config)
-    ts = now_ts()
-
-    bot_user = config.get("wiki_bot_user")
-    bot_password = config.get("wiki_bot_password")
-    wiki_api = config.get("wiki_api", "http://mediawiki/api.php")
-
-    if not all([bot_user, bot_password]) and not dry_run:
-        logger.warning("Bot credentials not configured, running in dry-run mode")
-        dry_run = True
-
-    # Find dead URLs with wayback snapshots that haven't been remediated
-    rows = execute(conn, """
-        SELECT la_id, la_url, la_wayback_url, la_wayback_ts,
-               la_dead_since, la_consecutive_failures, la_page_ids
-        FROM faw_link_archive
-        WHERE la_is_dead = 1
-          AND la_remediated = 0
-          AND la_wayback_url IS NOT NULL
-          AND la_consecutive_failures >= %s
-    """, (MIN_FAILURES,))
-
-    # Filter by dead duration
-    from datetime import datetime, timezone, timedelta
-    cutoff = datetime.now(timezone.utc) - timedelta(days=MIN_DEAD_DAYS)
-    cutoff_ts = cutoff.strftime("%Y%m%d%H%M%S")
-
-    eligible = []
-    for row in rows:
-        dead_since = row.get("la_dead_since", row.get(b"la_dead_since"))
-        if isinstance(dead_since, bytes):
-            dead_since = dead_since.decode("utf-8")
-        if dead_since and dead_since <= cutoff_ts:
-            eligible.append(row)
+REMEDIATED_SQL = """
+    UPDATE faw_link_archive SET
+        la_remediated = 1,
+        la_remediated_ts = %s
+    WHERE la_id = %s
+"""
 
-    if not eligible:
-        logger.debug("No dead links eligible for remediation")
-        return 0
+# Citation templates whose url= parameter gets archive parameters added
+CITE_TEMPLATES = {
+    "cite web", "cite news", "cite journal", "cite magazine", "cite book",
+    "cite video", "cite av media", "cite press release", "cite report",
+    "citation",
+}
+ARCHIVE_PARAMS = {"archive-url", "archiveurl"}
+# Present without an archive URL, these would be duplicated by the fix
+CONFLICT_PARAMS = {"archive-date", "archivedate", "url-status", "dead-url", "deadurl"}
+
+# Wikitext tokens: template open/close, external URLs, and regions whose
+# contents are not links (comments, nowiki)
+WIKITEXT_TOKEN = re.compile(
+    r"<!--.*?-->|<nowiki>.*?</nowiki>|\{\{|\}\}|https?://[^\s|{}\[\]<>\"]+",
+    re.IGNORECASE | re.DOTALL,
+)
+TEMPLATE_NAME = re.compile(r"\{\{\s*([^|{}<\n]*)")
+PARAM_TOKEN = re.compile(r"\{\{|\}\}|\[\[|\]\]|\|")
+
+# How a dead URL was found on a page
+FIXED = "fixed"        # url= of a citation template, archive parameters added
+ARCHIVED = "archived"  # url= of a citation template that already has archive-url
+BARE = "bare"          # anywhere else: bare or bracketed link, other template
+
+
+def run(config, dry_run=False, refresh=False):
+    """Remediate dead links with archive URLs.
+
+    refresh=True bypasses the snapshot index and cached lookups when
+    resolving snapshots for dead URLs that have none stored.
+    """
+    with connection(config) as conn:
+        ts = now_ts()
+
+        bot_user = config.get("wiki_bot_user")
+        bot_password = config.get("wiki_bot_password")
+        wiki_api = config.get("wiki_api", "http://mediawiki/api.php")
+
+        if not all([bot_user, bot_password]) and not dry_run:
+            logger.warning("Bot credentials not configured, running in dry-run mode")
+            dry_run = True
+
+        # Find dead URLs that haven't been remediated. Those without a
+        # stored wayback snapshot are resolved below, local index first.
+        rows = execute(conn, """
+            SELECT la_id, la_url, la_domain, la_wayback_url, la_wayback_ts,
+                   la_dead_since, la_consecutive_failures
+            FROM faw_link_archive
+            WHERE la_is_dead = 1
+              AND la_remediated = 0
+              AND la_consecutive_failures >= %s
+        """, (MIN_FAILURES,))
+
+        # Filter by dead duration
+        from datetime import datetime, timezone, timedelta
+        cutoff = datetime.now(timezone.utc) - timedelta(days=MIN_DEAD_DAYS)
+        cutoff_ts = cutoff.strftime("%Y%m%d%H%M%S")
+
+        index = open_snapshot_index(config)
+        eligible = []
+        for row in rows:
+            dead_since = row.get("la_dead_since", row.get(b"la_dead_since"))
+            if isinstance(dead_since, bytes):
+                dead_since = dead_since.decode("utf-8")
+            if not dead_since or dead_since > cutoff_ts:
+                continue
+            if not row.get("la_wayback_url", row.get(b"la_wayback_url")):
+                row = _resolve_snapshot(conn, index, row, ts, refresh)
+                if row is None:
+                    continue
+            eligible.append(row)
+        get_lookup_cache().log_stats("remediate-dead")
 
-    # Get bot session if not dry run
-    session = None
-    if not dry_run:
-        session = _get_bot_session(wiki_api, bot_user, bot_password)
-        if not session:
-            logger.error("Failed to authenticate bot")
+        if not eligible:
+            logger.debug("No dead links eligible for remediation")
             return 0
 
-    remediated = 0
-    flagged = 0
-    review_entries = []
-
-    for row in eligible:
-        la_id = row.get("la_id", row.get(b"la_id"))
-        url = row.get("la_url", row.get(b"la_url"))
-        if isinstance(url, bytes):
-            url = url.decode("utf-8", errors="replace")
-        wayback_url = row.get("la_wayback_url", row.get(b"la_wayback_url"))
-        if isinstance(wayback_url, bytes):
-            wayback_url = wayback_url.decode("utf-8", errors="replace")
-        wayback_ts = row.get("la_wayback_ts", row.get(b"la_wayback_ts"))
-        if isinstance(wayback_ts, bytes):
-            wayback_ts = wayback_ts.decode("utf-8", errors="replace")
-        page_ids_raw = row.get("la_page_ids", row.get(b"la_page_ids")) or b""
-        if isinstance(page_ids_raw, bytes):
-            page_ids_raw = page_ids_raw.decode("utf-8", errors="replace")
-
-        page_ids = [int(x) for x in page_ids_raw.split(",") if x.strip().isdigit()]
-
-        archive_date = _format_archive_date(wayback_ts)
-
-        for page_id in page_ids:
+        # Get bot session if not dry run
+        wiki = None
+        if not dry_run:
+            session = _get_bot_session(wiki_api, bot_user, bot_password)
+            if not session:
+                logger.error("Failed to authenticate bot")
+                return 0
+            wiki = WikiAPI(session, wiki_api)
+
+        pages_by_link = page_ids_for_links(
+            conn, [row.get("la_id", row.get(b"la_id")) for row in eligible]
+        )
+
+        # Regroup by page so each page is fetched once and edited once
+        links = {}
+        links_by_page = {}
+        for row in eligible:
+            la_id = row.get("la_id", row.get(b"la_id"))
+            wayback_ts = _text(row.get("la_wayback_ts", row.get(b"la_wayback_ts")))
+            url = _text(row.get("la_url", row.get(b"la_url")))
+            links[la_id] = {
+                "url": url,
+                "normalized": _normalize(url),
+                "wayback_url": _text(row.get("la_wayback_url", row.get(b"la_wayback_url"))),
+                "archive_date": _format_archive_date(wayback_ts),
+                "pages_left": len(pages_by_link.get(la_id, [])),
+            }
+            for page_id in pages_by_link.get(la_id, []):
+                links_by_page.setdefault(page_id, []).append(la_id)
+
+        remediated = 0
+        flagged = 0
+        review_entries = []
+        done = [la_id for la_id, link in links.items() if not link["pages_left"]]
+
+        for page_ids in chunked(sorted(links_by_page), PAGE_BATCH):
+            if out_of_time():
+                logger.warning("Time budget spent, stopping early")
+                break
             if dry_run:
-                content = _get_page_content_dry(conn, page_id)
+                pages = {page_id: _get_page_content_dry(conn, page_id) for page_id in page_ids}
             else:
-                content = _get_page_content(session, wiki_api, page_id)
+                pages = wiki.get_pages(page_ids)
+
+            for page_id in page_ids:
+                if page_id not in pages:
+                    continue  # not fetched; its links wait for the next run
+                page = pages[page_id]
+                content = page["content"] if page else None
+                page_links = [links[la_id] for la_id in links_by_page[page_id]]
+
+                if content:
+                    # One pass over the page for all of its dead URLs
+                    dead = {}
+                    for link in page_links:
+                        dead.setdefault(link["normalized"], link)
+                    new_content, found = _fix_dead_links(content, dead)
+
+                    fixed_links = []
+                    for link in page_links:
+                        seen = found.get(link["normalized"], set())
+                        if FIXED in seen:
+                            fixed_links.append(link)
+                        if BARE in seen or not seen:
+                            # Bare link, or not in the wikitext at all
+                            # (added by a template): flag for human review
+                            review_entries.append(_review_entry(link, page_id))
+                            flagged += 1
+
+                    if fixed_links and dry_run:
+                        logger.info("[DRY RUN] Would auto-fix %d citation templates on page %d",
+                                    len(fixed_links), page_id)
+                        remediated += len(fixed_links)
+                    elif fixed_links:
+                        saved = wiki.edit({
+                            "pageid": page_id,
+                            "text": new_content,
+                            "basetimestamp": page["timestamp"],
+                            "summary": _edit_summary([link["url"] for link in fixed_links]),
+                        })
+                        if saved:
+                            remediated += len(fixed_links)
+                        else:
+                            # Edit conflict or refusal: leave it to a human
+                            review_entries.extend(_review_entry(link, page_id) for link in fixed_links)
+                            flagged += len(fixed_links)
+
+                for la_id in links_by_page[page_id]:
+                    links[la_id]["pages_left"] -= 1
+                    if not links[la_id]["pages_left"]:
+                        done.append(la_id)
+
+        # Mark as remediated once every page linking the URL was handled
+        if not dry_run:
+            with BatchWriter(conn) as writer:
+                for la_id in done:
+                    writer.add(REMEDIATED_SQL, (ts, la_id))
+
+        # Write review page if there are flagged links
+        if review_entries and not dry_run:
+            _write_review_page(wiki, review_entries)
+
+        logger.info("Remediated %d links, flagged %d for review across %d pages",
+                    remediated, flagged, len(links_by_page))
+        return remediated + flagged
+
+
+def _resolve_snapshot(conn, index, row, ts, refresh=False):
+    """Fill in a Wayback snapshot for a dead row that has none stored.
+
+    Returns the row with la_wayback_url/la_wayback_ts set (and persisted),
+    or None if no snapshot exists.
+    """
+    url = row.get("la_url", row.get(b"la_url"))
+    if isinstance(url, bytes):
+        url = url.decode("utf-8", errors="replace")
+    domain = row.get("la_domain", row.get(b"la_domain"))
+    if isinstance(domain, bytes):
+        domain = domain.decode("utf-8", errors="replace")
+
+    dead_since = row.get("la_dead_since", row.get(b"la_dead_since"))
+    if isinstance(dead_since, bytes):
+        dead_since = dead_since.decode("utf-8")
+
+    # Only 200 captures count, and one from before the link died is
+    # preferred: later ones are often a parked domain or an error page
+    snapshot = None
+    state = None
+    if index and not refresh:
+        state, snapshot = index.lookup(url, domain)
+    if state == HIT and dead_since and snapshot["timestamp"] > dead_since:
+        snapshot = cdx_lookup(url, refresh=refresh, before=dead_since) or snapshot
+    elif state != MISS:
+        snapshot = None
+        if dead_since:
+            snapshot = cdx_lookup(url, refresh=refresh, before=dead_since)
+        if not snapshot:
+            snapshot = cdx_lookup(url, refresh=refresh)
+    if not snapshot:
+        return None
 
-            if not content:
+    la_id = row.get("la_id", row.get(b"la_id"))
+    execute(conn, """
+        UPDATE faw_link_archive SET
+            la_wayback_url = %s,
+            la_wayback_ts = %s,
+            la_spn2_status = 'success',
+            la_spn2_last = %s
+        WHERE la_id = %s
+    """, (snapshot["wayback_url"].encode("utf-8"), snapshot["timestamp"].encode("utf-8"), ts, la_id))
+
+    row = dict(row)
+    row["la_wayback_url"] = snapshot["wayback_url"]
+    row["la_wayback_ts"] = snapshot["timestamp"]
+    return row
+
+
+def _fix_dead_links(content, dead):
+    """Add archive parameters for every dead URL on a page in one pass.
+
+    dead maps normalized URL -> link dict (wayback_url, archive_date).
+    The wikitext is tokenized once; each external URL is matched by its
+    normalized form, so a URL never matches another it is a prefix of.
+
+    Returns (new_content, {normalized URL: set of FIXED/ARCHIVED/BARE}).
+    """
+    found = {}
+    inserts = []  # (position, text)
+    stack = []    # open templates: [start, is_cite, [(normalized, start, end)]]
+
+    for match in WIKITEXT_TOKEN.finditer(content):
+        token = match.group(0)
+        if token == "{{":
+            name = TEMPLATE_NAME.match(content, match.start()).group(1)
+            stack.append([match.start(), _template_key(name) in CITE_TEMPLATES, []])
+        elif token == "}}":
+            if not stack:
                 continue
-
-            # Try auto-fix for cite web templates
-            new_content, fixed = _fix_cite_web(content, url, wayback_url, archive_date)
-            if fixed:
-                if dry_run:
-                    logger.info("[DRY RUN] Would auto-fix cite web on page %d for %s", page_id, url)
-                else:
-                    _save_page(session, wiki_api, page_id, new_content,
-                               f"LinkKeeper: Added archive URL for dead link {url}")
-                remediated += 1
+            start, is_cite, urls = stack.pop()
+            if is_cite:
+                _fix_template(content, start, match.end(), urls, dead, found, inserts)
             else:
-                # Flag for human review
-                review_entries.append({
-                    "url": url,
-                    "wayback_url": wayback_url,
-                    "page_id": page_id,
-                })
-                flagged += 1
-
-        # Mark as remediated
-        execute(conn, """
-            UPDATE faw_link_archive SET
-                la_remediated = 1,
-                la_remediated_ts = %s
-            WHERE la_id = %s
-        """, (ts, la_id))
-
-    # Write review page if there are flagged links
-    if review_entries and not dry_run:
-        _write_review_page(session, wiki_api, review_entries)
-
-    logger.info("Remediated %d links, flagged %d for review", remediated, flagged)
-    conn.close()
-    return remediated + flagged
-
-
-def _fix_cite_web(content, dead_url, wayback_url, archive_date):
-    """Add archive-url to a cite web template containing the dead URL."""
-    if dead_url not in content:
-        return content, False
-
-    # Check if already has archive-url
-    if "archive-url" in content and wayback_url in content:
-        return content, False
-
-    def replace_cite(match):
-        prefix = match.group(1)
-        url = match.group(2)
-        suffix = match.group(3)
-
-        if url.rstrip("/") != dead_url.rstrip("/"):
-            return match.group(0)
-
-        # Don't double-add
-        if "archive-url" in suffix:
-            return match.group(0)
-
-        archive_params = (
-            f" |archive-url={wayback_url}"
-            f" |archive-date={archive_date}"
-            f" |url-status=dead"
-        )
-        return f"{prefix}{url}{archive_params}{suffix}"
+                for normalized, _, _ in urls:
+                    found.setdefault(normalized, set()).add(BARE)
+        elif token.startswith("<"):
+            continue
+        else:
+            url = token.rstrip(".,;:!?'")
+            if url.endswith(")") and "(" not in url:
+                url = url[:-1]
+            normalized = _normalize(url)
+            if normalized is None or normalized not in dead:
+                continue
+            if stack:
+                stack[-1][2].append((normalized, match.start(), match.start() + len(url)))
+            else:
+                found.setdefault(normalized, set()).add(BARE)
+
+    # Templates left open at the end of the page
+    for _, _, urls in stack:
+        for normalized, _, _ in urls:
+            found.setdefault(normalized, set()).add(BARE)
+
+    if not inserts:
+        return content, found
+    parts = []
+    last = 0
+    for pos, text in sorted(inserts):
+        parts.append(content[last:pos])
+        parts.append(text)
+        last = pos
+    parts.append(content[last:])
+    return "".join(parts), found
+
+
+def _fix_template(content, start, end, urls, dead, found, inserts):
+    """Handle the dead URLs inside one citation template content[start:end]."""
+    params = {}
+    url_value = None
+    for param_start, param_end in _template_params(content, start, end):
+        name, eq, value = content[param_start:param_end].partition("=")
+        if not eq:
+            continue
+        name = name.strip().lower()
+        params[name] = value.strip()
+        if name == "url":
+            value_start = content.index("=", param_start) + 1
+            url_value = (
+                _normalize(value.strip()),
+                value_start + len(value) - len(value.lstrip()),
+                value_start + len(value.rstrip()),
+            )
+
+    for normalized, url_start, _ in urls:
+        if url_value is None or (normalized, url_start) != url_value[:2]:
+            found.setdefault(normalized, set()).add(BARE)
+        elif any(params.get(name) for name in ARCHIVE_PARAMS):
+            found.setdefault(normalized, set()).add(ARCHIVED)
+        elif ARCHIVE_PARAMS.union(CONFLICT_PARAMS).intersection(params):
+            found.setdefault(normalized, set()).add(BARE)
+        else:
+            link = dead[normalized]
+            inserts.append((url_value[2], (
+                f" |archive-url={link['wayback_url']}"
+                f" |archive-date={link['archive_date']}"
+                f" |url-status=dead"
+            )))
+            found.setdefault(normalized, set()).add(FIXED)
+
+
+def _template_params(content, start, end):
+    """(start, end) of each top-level parameter of the template content[start:end]."""
+    params = []
+    depth = 0
+    param_start = None
+    for match in PARAM_TOKEN.finditer(content, start + 2, end - 2):
+        token = match.group(0)
+        if token in ("{{", "[["):
+            depth += 1
+        elif token in ("}}", "]]"):
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            if param_start is not None:
+                params.append((param_start, match.start()))
+            param_start = match.end()
+    if param_start is not None:
+        params.append((param_start, end - 2))
+    return params
+
+
+def _template_key(name):
+    return " ".join(name.replace("_", " ").split()).lower()
+
+
+def _normalize(url):
+    """Match key for a URL; a trailing slash doesn't make it a different link."""
+    try:
+        return normalize_url(url).rstrip("/")
+    except ValueError:
+        return None
 
-    new_content = CITE_WEB_PATTERN.sub(replace_cite, content)
-    return new_content, new_content != content
+
+def _review_entry(link, page_id):
+    return {"url": link["url"], "wayback_url": link["wayback_url"], "page_id": page_id}
 
 
 def _format_archive_date(wayback_ts):
@@ -180,6 +414,18 @@ def _format_archive_date(wayback_ts):
     return f"{wayback_ts[:4]}-{wayback_ts[4:6]}-{wayback_ts[6:8]}"
 
 
+def _edit_summary(urls):
+    if len(urls) == 1:
+        return f"LinkKeeper: Added archive URL for dead link {urls[0]}"
+    return f"LinkKeeper: Added archive URLs for {len(urls)} dead links"
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
 def _get_bot_session(api_url, username, password):
     """Authenticate with the MediaWiki API and return a session."""
     session = requests.Session()
@@ -211,61 +457,126 @@ def _get_bot_session(api_url, username, password):
         return None
 
 
-def _get_page_content(session, api_url, page_id):
-    """Get wikitext content of a page by ID."""
-    try:
-        resp = session.get(api_url, params={
+class WikiAPI:
+    """Bot calls to the MediaWiki API on a logged-in session.
+
+    Every request carries maxlag, so when replication lag is high the
+    wiki answers with a maxlag error and we wait (Retry-After) and retry
+    instead of adding load. The CSRF token is fetched once and reused
+    until the wiki rejects it.
+    """
+
+    def __init__(self, session, api_url):
+        self.session = session
+        self.api_url = api_url
+        self._csrf_token = None
+
+    def _call(self, method, params):
+        params = dict(params, format="json", maxlag=MAXLAG)
+        for attempt in range(MAXLAG_RETRIES + 1):
+            if method == "GET":
+                resp = self.session.get(self.api_url, params=params, timeout=60)
+            else:
+                resp = self.session.post(self.api_url, data=params, timeout=60)
+            data = resp.json()
+            if data.get("error", {}).get("code") != "maxlag":
+                return data
+            if attempt == MAXLAG_RETRIES or out_of_time():
+                break
+            wait = int(resp.headers.get("Retry-After", MAXLAG_WAIT))
+            logger.info("Wiki lagged (%s), retrying in %ds",
+                        data["error"].get("info", "maxlag"), wait)
+            time.sleep(wait)
+        return data
+
+    def csrf_token(self, refresh=False):
+        if self._csrf_token is None or refresh:
+            data = self._call("GET", {"action": "query", "meta": "tokens"})
+            self._csrf_token = data["query"]["tokens"]["csrftoken"]
+        return self._csrf_token
+
+    def get_pages(self, page_ids):
+        """Return {page_id: {"content", "timestamp"} or None} for up to PAGE_BATCH pages.
+
+        None marks a page the wiki reports missing. Pages that could not
+        be fetched (errors, lag that outlasted the retries) are left out.
+        """
+        pages = {}
+        params = {
             "action": "query",
-            "pageids": page_id,
+            "pageids": "|".join(str(page_id) for page_id in page_ids),
             "prop": "revisions",
-            "rvprop": "content",
+            "rvprop": "content|timestamp",
             "rvslots": "main",
-            "format": "json",
-        })
-        pages = resp.json().get("query", {}).get("pages", {})
-        page = pages.get(str(page_id), {})
-        revisions = page.get("revisions", [])
-        if revisions:
-            return revisions[0].get("slots", {}).get("main", {}).get("*", "")
-        return None
-    except Exception as e:
-        logger.error("Failed to get page %d content: %s", page_id, e)
-        return None
+        }
+        try:
+            while True:
+                data = self._call("GET", params)
+                if "error" in data:
+                    logger.warning("Failed to get content for pages %s: %s",
+                                   params["pageids"], data["error"].get("info", data["error"]))
+                    break
+                for key, page in data.get("query", {}).get("pages", {}).items():
+                    revisions = page.get("revisions", [])
+                    if "missing" in page:
+                        pages[int(key)] = None
+                    elif revisions:
+                        pages[int(key)] = {
+                            "content": revisions[0].get("slots", {}).get("main", {}).get("*", ""),
+                            "timestamp": revisions[0].get("timestamp"),
+                        }
+                # Large pages can spill into continuation requests
+                if "continue" not in data:
+                    break
+                params = dict(params, **data["continue"])
+        except Exception as e:
+            logger.error("Failed to get content for pages %s: %s", params["pageids"], e)
+        return pages
+
+    def get_page_by_title(self, title):
+        """Get wikitext by page title."""
+        try:
+            data = self._call("GET", {
+                "action": "query",
+                "titles": title,
+                "prop": "revisions",
+                "rvprop": "content",
+                "rvslots": "main",
+            })
+            for page in data.get("query", {}).get("pages", {}).values():
+                revisions = page.get("revisions", [])
+                if revisions:
+                    return revisions[0].get("slots", {}).get("main", {}).get("*", "")
+            return None
+        except Exception:
+            return None
+
+    def edit(self, params):
+        """Save an edit (pageid or title, text, summary, ...); True on success."""
+        target = params.get("pageid", params.get("title"))
+        try:
+            for refresh in (False, True):
+                data = self._call("POST", dict(
+                    params, action="edit", bot=1, token=self.csrf_token(refresh),
+                ))
+                if data.get("error", {}).get("code") != "badtoken":
+                    break
+            result = data.get("edit", {}).get("result")
+            if result != "Success":
+                logger.error("Failed to save page %s: %s", target, data)
+                return False
+            return True
+        except Exception as e:
+            logger.error("Error saving page %s: %s", target, e)
+            return False
 
 
 def _get_page_content_dry(conn, page_id):
-    """Placeholder for dry-run mode - returns empty string."""
-    return ""
+    """Placeholder for dry-run mode - reports the page as missing."""
+    return None
 
 
-def _save_page(session, api_url, page_id, content, summary):
-    """Save wikitext content to a page."""
-    try:
-        # Get CSRF token
-        resp = session.get(api_url, params={
-            "action": "query",
-            "meta": "tokens",
-            "format": "json",
-        })
-        csrf_token = resp.json()["query"]["tokens"]["csrftoken"]
-
-        resp = session.post(api_url, data={
-            "action": "edit",
-            "pageid": page_id,
-            "text": content,
-            "summary": summary,
-            "bot": 1,
-            "token": csrf_token,
-            "format": "json",
-        })
-        result = resp.json().get("edit", {}).get("result")
-        if result != "Success":
-            logger.error("Failed to save page %d: %s", page_id, resp.json())
-    except Exception as e:
-        logger.error("Error saving page %d: %s", page_id, e)
-
-
-def _write_review_page(session, api_url, entries):
+def _write_review_page(wiki, entries):
     """Write or append to the Project:LinkKeeper/Review maintenance page."""
     from datetime import datetime, timezone
 
@@ -280,7 +591,7 @@ def _write_review_page(session, api_url, entries):
     new_section = "".join(lines)
 
     # Get existing content
-    existing = _get_page_content_by_title(session, api_url, "Project:LinkKeeper/Review")
+    existing = wiki.get_page_by_title(REVIEW_PAGE)
     if existing:
         content = existing + "\n" + new_section
     else:
@@ -290,49 +601,8 @@ def _write_review_page(session, api_url, entries):
             + new_section
         )
 
-    _save_page_by_title(session, api_url, "Project:LinkKeeper/Review", content,
-                         "LinkKeeper: Added dead links for review")
-
-
-def _get_page_content_by_title(session, api_url, title):
-    """Get wikitext by page title."""
-    try:
-        resp = session.get(api_url, params={
-            "action": "query",
-            "titles": title,
-            "prop": "revisions",
-            "rvprop": "content",
-            "rvslots": "main",
-            "format": "json",
-        })
-        pages = resp.json().get("query", {}).get("pages", {})
-        for page in pages.values():
-            revisions = page.get("revisions", [])
-            if revisions:
-                return revisions[0].get("slots", {}).get("main", {}).get("*", "")
-        return None
-    except Exception:
-        return None
-
-
-def _save_page_by_title(session, api_url, title, content, summary):
-    """Save wikitext to a page by title."""
-    try:
-        resp = session.get(api_url, params={
-            "action": "query",
-            "meta": "tokens",
-            "format": "json",
-        })
-        csrf_token = resp.json()["query"]["tokens"]["csrftoken"]
-
-        session.post(api_url, data={
-            "action": "edit",
-            "title": title,
-            "text": content,
-            "summary": summary,
-            "bot": 1,
-            "token": csrf_token,
-            "format": "json",
-        })
-    except Exception as e:
-        logger.error("Error saving page %s: %s", title, e)
+    wiki.edit({
+        "title": REVIEW_PAGE,
+        "text": content,
+        "summary": "LinkKeeper: Added dead links for review",
+    })
@@ -1,15 +1,43 @@
 """WARC snapshots of priority domains to R2.
 
 Runs weekly (Sunday 2:30 AM). Captures pages from high-risk domains
-as local WARC archives, independent of archive.org.
+as local WARC archives, independent of archive.org. Only URLs last
+captured (la_r2_verified) longer than STALE_AFTER ago are taken, oldest
+first, and each domain is captured in its own lane: lanes run
+concurrently, while within a lane requests go one at a time through the
+domain's rate limit bucket.
+
+Each domain's captures go into one multi-record WARC file (a new one is
+started past ROLL_SIZE), uploaded together with its sidecar CDXJ index.
+la_r2_key names the object and la_r2_offset/la_r2_size locate the
+URL's record inside it.
+
+Pages whose payload digest matches la_r2_digest get a revisit record
+instead of a full copy, and the row keeps pointing at the original
+record; only la_r2_verified moves on. A file holding nothing but
+revisits is not uploaded at all.
+
+By default WARC bytes are streamed straight to R2 as multipart parts
+while the next pages are captured (WARC_UPLOAD_MODE=stream); with
+WARC_UPLOAD_MODE=file each WARC is written under WARC_DIR and uploaded
+once closed.
 """
 
 import os
+import time
+import queue
 import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from lib.db import get_connection, execute, now_ts
-from lib.warc_writer import capture_url_to_warc
-from lib.r2_client import get_r2_client, upload_warc
+from lib.db import connection, execute, ts_in, BatchWriter
+from lib.warc_writer import RollingWARCFile, ROLL_SIZE, warc_filename
+from lib.r2_client import (
+    get_r2_client, upload_warc, upload_bytes, BackgroundUploader, MultipartUpload,
+)
+from lib.ratelimit import get_limiter
+from lib.cdxj_index import open_cdxj_index
+from lib.scheduler import out_of_time
 
 logger = logging.getLogger("linkkeeper.snapshot_critical")
 
@@ -27,8 +55,29 @@ PRIORITY_DOMAINS = [
     "flamebuoyant.com",
 ]
 
+WARC_DIR = "/tmp/linkkeeper-warcs"  # local WARCs in file upload mode
+STALE_AFTER = 6 * 24 * 3600         # recapture URLs snapshotted longer ago than this
+DEFAULT_LIMIT = 5000                # URLs per run unless --limit is given
+IDLE_SECONDS = 1.0                  # how often a waiting run checks for a due flush
+
+SNAPSHOT_SQL = """
+    UPDATE faw_link_archive SET
+        la_r2_key = %s,
+        la_r2_offset = %s,
+        la_r2_ts = %s,
+        la_r2_size = %s,
+        la_r2_digest = %s,
+        la_r2_verified = %s
+    WHERE la_id = %s
+"""
 
-def run(config, domain=None, limit=None):
+# An unchanged page: the stored record stands, only the check is recorded
+VERIFIED_SQL = """
+    UPDATE faw_link_archive SET la_r2_verified = %s WHERE la_id = %s
+"""
+
+
+def run(config, domain=None, limit=None, concurrency=4):
     """Capture WARC snapshots of critical domain URLs and upload to R2."""
     r2_endpoint = config.get("r2_endpoint")
     r2_access = config.get("r2_access_key")
@@ -39,77 +88,236 @@ def run(config, domain=None, limit=None):
         logger.warning("R2 not configured, skipping WARC snapshots")
         return 0
 
-    conn = get_connection(config)
-    ts = now_ts()
+    with connection(config) as conn:
+        # Build domain filter
+        if domain:
+            domains = [domain]
+        else:
+            domains = PRIORITY_DOMAINS
 
-    # Build domain filter
-    if domain:
-        domains = [domain]
-    else:
-        domains = PRIORITY_DOMAINS
+        domain_placeholders = ",".join(["%s"] * len(domains))
+        stale_ts = ts_in(-STALE_AFTER)
 
-    domain_placeholders = ",".join(["%s"] * len(domains))
+        # Never-captured URLs (NULL) sort first. Unchanged pages count as
+        # captured when last verified, so they don't hog the front.
+        rows = execute(conn, f"""
+            SELECT la_id, la_url, la_domain, la_r2_key, la_r2_ts, la_r2_digest
+            FROM faw_link_archive
+            WHERE la_is_dead = 0
+              AND la_domain IN ({domain_placeholders})
+              AND (COALESCE(la_r2_verified, la_r2_ts) IS NULL
+                   OR COALESCE(la_r2_verified, la_r2_ts) < %s)
+            ORDER BY COALESCE(la_r2_verified, la_r2_ts) ASC, la_id ASC
+            LIMIT %s
+        """, tuple(d.encode("utf-8") if isinstance(d, str) else d for d in domains)
+             + (stale_ts, limit or DEFAULT_LIMIT))
 
-    rows = execute(conn, f"""
-        SELECT la_id, la_url, la_domain
-        FROM faw_link_archive
-        WHERE la_is_dead = 0
-          AND la_domain IN ({domain_placeholders})
-        ORDER BY la_r2_ts ASC, la_id ASC
-    """, tuple(d.encode("utf-8") if isinstance(d, str) else d for d in domains))
+        if not rows:
+            logger.debug("No critical URLs to snapshot")
+            return 0
 
-    if limit:
-        rows = rows[:limit]
+        r2 = get_r2_client({
+            "r2_endpoint": r2_endpoint,
+            "r2_access_key": r2_access,
+            "r2_secret_key": r2_secret,
+        })
 
-    if not rows:
-        logger.debug("No critical URLs to snapshot")
-        return 0
+        lanes = {}
+        for row in rows:
+            lanes.setdefault(_text(row.get("la_domain", row.get(b"la_domain"))), []).append(row)
+
+        max_bytes = config.get("warc_max_bytes")
+        stream = config.get("warc_upload_mode", "stream") != "file"
+        uploader = BackgroundUploader()
+        cdxj = open_cdxj_index(config)
+        finished = queue.Queue()  # ([(sql, params)], lane stats or None)
+        stats = Counter()
+        started = time.monotonic()
+
+        def lane(url_domain, domain_rows):
+            lane_stats = Counter()
+            try:
+                _capture_domain(url_domain, domain_rows, r2, r2_bucket, uploader,
+                                stream, max_bytes, cdxj, finished, lane_stats)
+            except Exception:
+                logger.exception("Snapshot lane for %s failed", url_domain)
+            finally:
+                finished.put(([], lane_stats))
+
+        try:
+            with BatchWriter(conn) as writer, \
+                    ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for url_domain, domain_rows in lanes.items():
+                    pool.submit(lane, url_domain, domain_rows)
+
+                # Record each uploaded file's captures as it lands
+                open_lanes = len(lanes)
+                while open_lanes:
+                    try:
+                        writes, lane_stats = finished.get(timeout=IDLE_SECONDS)
+                    except queue.Empty:
+                        writer.flush_if_due()
+                        continue
+                    for sql, params in writes:
+                        writer.add(sql, params)
+                    if lane_stats is not None:
+                        stats.update(lane_stats)
+                        open_lanes -= 1
+        finally:
+            uploader.shutdown()
+
+        elapsed = max(time.monotonic() - started, 0.001)
+        logger.info("Captured and uploaded %d WARC snapshots, %d pages unchanged, "
+                    "%d failed", stats["captured"], stats["unchanged"], stats["failed"])
+        logger.info("Throughput: %.1f URLs/min, %.0f bytes/sec over %d domains in %.0fs",
+                    stats["attempted"] * 60 / elapsed, stats["bytes"] / elapsed,
+                    len(lanes), elapsed)
+        return stats["captured"]
 
-    r2 = get_r2_client({
-        "r2_endpoint": r2_endpoint,
-        "r2_access_key": r2_access,
-        "r2_secret_key": r2_secret,
-    })
-
-    captured = 0
-    warc_dir = "/tmp/linkkeeper-warcs"
-
-    for row in rows:
-        la_id = row.get("la_id", row.get(b"la_id"))
-        url = row.get("la_url", row.get(b"la_url"))
-        if isinstance(url, bytes):
-            url = url.decode("utf-8", errors="replace")
-        url_domain = row.get("la_domain", row.get(b"la_domain"))
-        if isinstance(url_domain, bytes):
-            url_domain = url_domain.decode("utf-8", errors="replace")
-
-        warc_result = capture_url_to_warc(url, output_dir=warc_dir)
-        if not warc_result["success"]:
-            logger.warning("WARC capture failed for %s: %s", url, warc_result["error"])
-            continue
-
-        # Upload to R2
-        r2_key = f"warcs/{url_domain}/{os.path.basename(warc_result['path'])}"
-        upload_result = upload_warc(r2, r2_bucket, r2_key, warc_result["path"])
-
-        if upload_result["success"]:
-            execute(conn, """
-                UPDATE faw_link_archive SET
-                    la_r2_key = %s,
-                    la_r2_ts = %s,
-                    la_r2_size = %s
-                WHERE la_id = %s
-            """, (r2_key.encode("utf-8"), ts, upload_result["size"], la_id))
-            captured += 1
+
+def _capture_domain(url_domain, rows, r2, r2_bucket, uploader, stream, max_bytes,
+                    cdxj, finished, stats):
+    """One lane: capture a domain's URLs in order, one request at a time.
+
+    (sql, params) writes are put on `finished` for the main thread,
+    which owns the DB connection: VERIFIED_SQL for each unchanged page,
+    SNAPSHOT_SQL for the captures of each uploaded file.
+    """
+    target = None
+    captures = []  # (la_id, record) in the open file
+    try:
+        for row in rows:
+            if out_of_time():
+                logger.warning("Time budget spent, stopping %s early", url_domain)
+                break
+            la_id = row.get("la_id", row.get(b"la_id"))
+            url = _text(row.get("la_url", row.get(b"la_url")))
+
+            previous = None
+            digest = row.get("la_r2_digest", row.get(b"la_r2_digest"))
+            if digest and row.get("la_r2_key", row.get(b"la_r2_key")):
+                previous = {
+                    "digest": _text(digest),
+                    "timestamp": _text(row.get("la_r2_ts", row.get(b"la_r2_ts"))),
+                }
+
+            if target is None:
+                target = _open_warc(r2, r2_bucket, url_domain, uploader, stream)
+
+            get_limiter().acquire(f"domain:{url_domain}")
+            before = target["warc"].size
+            record = target["warc"].add(url, max_bytes, previous)
+            stats["attempted"] += 1
+            stats["bytes"] += target["warc"].size - before
+            if not record["success"]:
+                logger.warning("WARC capture failed for %s: %s", url, record["error"])
+                stats["failed"] += 1
+                continue
+            if record["revisit"]:
+                stats["unchanged"] += 1
+                finished.put(([(VERIFIED_SQL, (record["timestamp"], la_id))], None))
+            else:
+                captures.append((la_id, record))
+
+            if target["warc"].size >= ROLL_SIZE:
+                stats["captured"] += _finish(target, captures, r2, r2_bucket, cdxj, finished)
+                target, captures = None, []
+
+        if target is not None:
+            stats["captured"] += _finish(target, captures, r2, r2_bucket, cdxj, finished)
+    except BaseException:
+        # Don't leave a half-written file behind (or an open multipart
+        # upload in R2, billed for its parts)
+        if target is not None:
+            _abandon(target)
+        raise
+
+
+def _open_warc(r2, r2_bucket, url_domain, uploader, stream):
+    """Start a WARC file for a domain, streamed to R2 or written locally."""
+    filename = warc_filename(url_domain)
+    key = f"warcs/{url_domain}/{filename}"
+    if stream:
+        out = MultipartUpload(r2, r2_bucket, key, uploader)
+        path = None
+    else:
+        os.makedirs(WARC_DIR, exist_ok=True)
+        path = os.path.join(WARC_DIR, filename)
+        out = open(path, "wb")
+    target = {"warc": None, "out": out, "key": key, "path": path}
+    try:
+        target["warc"] = RollingWARCFile(out, filename)
+    except BaseException:
+        _abandon(target)
+        raise
+    return target
+
+
+def _abandon(target):
+    """Discard an unfinished WARC file: abort the upload or delete the local file."""
+    out, path = target["out"], target["path"]
+    try:
+        if path is None:
+            out.abort()
         else:
-            logger.warning("R2 upload failed for %s: %s", url, upload_result["error"])
+            out.close()
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Could not discard %s: %s", target["key"], e)
+
+
+def _finish(target, captures, r2, r2_bucket, cdxj, finished):
+    """Close a WARC file, upload it with its index, and queue its captures."""
+    warc, r2_key, path = target["warc"], target["key"], target["path"]
+    try:
+        if not captures:
+            logger.info("No changed pages in %s, skipping upload", warc.filename)
+            _abandon(target)
+            return 0
 
-        # Clean up local WARC file
         try:
-            os.remove(warc_result["path"])
-        except OSError:
-            pass
+            warc.close()
+        except Exception as e:
+            logger.warning("R2 upload failed for %s: %s", r2_key, e)
+            return 0
+        if path is not None:
+            upload_result = upload_warc(r2, r2_bucket, r2_key, path)
+            if not upload_result["success"]:
+                logger.warning("R2 upload failed for %s: %s", r2_key, upload_result["error"])
+                return 0
+
+        cdxj_key = r2_key[:-len(".warc.gz")] + ".cdxj"
+        index_text = warc.index()
+        index_result = upload_bytes(r2, r2_bucket, cdxj_key, index_text.encode("utf-8"),
+                                    "application/x-ndjson")
+        if not index_result["success"]:
+            logger.warning("R2 upload failed for %s: %s", cdxj_key, index_result["error"])
+        if cdxj:
+            try:
+                cdxj.add_sidecar(r2_key, index_text)
+            except OSError as e:
+                logger.warning("Could not update local CDXJ index for %s: %s", r2_key, e)
+
+        finished.put(([
+            (SNAPSHOT_SQL, (
+                r2_key.encode("utf-8"), record["offset"], record["timestamp"], record["length"],
+                record["payload_digest"].encode("utf-8"), record["timestamp"], la_id,
+            ))
+            for la_id, record in captures
+        ], None))
+        return len(captures)
+    finally:
+        # Clean up the local WARC file
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
 
-    logger.info("Captured and uploaded %d WARC snapshots", captured)
-    conn.close()
-    return captured
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
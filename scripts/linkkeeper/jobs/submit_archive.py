@@ -1,114 +1,233 @@
 """Submit URLs to Internet Archive via CDX lookup + SPN2.
 
 Runs every 6 hours. Checks CDX first (free), only submits to SPN2 if
-no recent snapshot exists. 50 URLs per batch.
+no recent snapshot exists. 500 URLs per batch. Submitted URLs stay
+'pending' until poll-archive collects the result of their SPN2 job.
+
+Domains with several URLs in the batch are listed from CDX in bulk first
+(see lib/snapshot_index.py); per-URL CDX lookups are only made for URLs
+that index cannot answer.
+
+The batch runs as a pipeline so free lookups never wait behind the SPN2
+pacing: a pool of CDX workers feeds a queue drained by one SPN2
+submitter thread, and both report to the main thread, which owns the DB
+connection and writes results back in batches.
 """
 
+import queue
 import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from lib.db import get_connection, execute, now_ts
+from lib.db import connection, execute, now_ts, BatchWriter
 from lib.wayback import cdx_lookup, submit_spn2
+from lib.scheduler import out_of_time
+from lib.lookup_cache import get_lookup_cache
+from lib.snapshot_index import open_snapshot_index, PREFETCH_MIN_URLS, HIT, MISS
 
 logger = logging.getLogger("linkkeeper.submit_archive")
 
 # Only submit to SPN2 if last snapshot is older than 90 days
 STALE_DAYS = 90
 
+FLUSH_SIZE = 100      # results per write-back flush
+FLUSH_SECONDS = 5.0
+IDLE_SECONDS = 1.0    # how often a waiting run checks for a due flush
+
+# Fixed statement text for the write-back, run through execute_many
+SNAPSHOT_SQL = """
+    UPDATE faw_link_archive SET
+        la_wayback_url = %s,
+        la_wayback_ts = %s,
+        la_spn2_status = 'success',
+        la_spn2_last = %s
+    WHERE la_id = %s
+"""
+
+# After an SPN2 submission: 'pending' with the job id (resolved later by
+# poll-archive) or 'error'. A stale snapshot found on the way is kept.
+SPN2_SQL = """
+    UPDATE faw_link_archive SET
+        la_wayback_url = COALESCE(%s, la_wayback_url),
+        la_wayback_ts = COALESCE(%s, la_wayback_ts),
+        la_spn2_status = %s,
+        la_spn2_job_id = %s,
+        la_spn2_last = %s
+    WHERE la_id = %s
+"""
+
 
-def run(config, batch=50, dry_run=False):
-    """Check and submit URLs to Internet Archive."""
-    conn = get_connection(config)
-    ts = now_ts()
-
-    ia_access = config.get("ia_access_key")
-    ia_secret = config.get("ia_secret_key")
-    has_ia_keys = bool(ia_access and ia_secret)
-
-    # Get URLs that haven't been checked with CDX recently
-    # or have never been submitted
-    rows = execute(conn, """
-        SELECT la_id, la_url, la_spn2_status, la_wayback_ts
-        FROM faw_link_archive
-        WHERE la_is_dead = 0
-          AND (la_spn2_status = 'none' OR la_spn2_status = 'error')
-        ORDER BY la_spn2_last ASC, la_id ASC
-        LIMIT %s
-    """, (batch,))
-
-    if not rows:
-        logger.debug("No URLs need archival")
-        return 0
-
-    processed = 0
-    submitted = 0
-
-    for row in rows:
-        la_id = row.get("la_id", row.get(b"la_id"))
-        url = row.get("la_url", row.get(b"la_url"))
-        if isinstance(url, bytes):
-            url = url.decode("utf-8", errors="replace")
-
-        # Step 1: CDX lookup (always free)
-        snapshot = cdx_lookup(url)
-
-        if snapshot:
-            wayback_url = snapshot["wayback_url"]
-            wayback_ts = snapshot["timestamp"]
-
-            execute(conn, """
-                UPDATE faw_link_archive SET
-                    la_wayback_url = %s,
-                    la_wayback_ts = %s,
-                    la_spn2_status = 'success',
-                    la_spn2_last = %s
-                WHERE la_id = %s
-            """, (
-                wayback_url.encode("utf-8"),
-                wayback_ts.encode("utf-8") if isinstance(wayback_ts, str) else wayback_ts,
-                ts,
-                la_id,
-            ))
-
-            # Check if snapshot is recent enough
-            if _is_recent(wayback_ts, STALE_DAYS):
-                logger.debug("Recent snapshot exists for %s", url)
-                processed += 1
-                continue
-
-        # Step 2: SPN2 submission (requires IA keys)
-        if not has_ia_keys:
-            logger.debug("No IA keys, skipping SPN2 for %s", url)
-            processed += 1
-            continue
-
-        if dry_run:
-            logger.info("[DRY RUN] Would submit to SPN2: %s", url)
-            processed += 1
-            continue
-
-        result = submit_spn2(url, ia_access, ia_secret)
-
-        if result["success"]:
-            execute(conn, """
-                UPDATE faw_link_archive SET
-                    la_spn2_status = 'pending',
-                    la_spn2_last = %s
-                WHERE la_id = %s
-            """, (ts, la_id))
-            submitted += 1
-        else:
-            execute(conn, """
-                UPDATE faw_link_archive SET
-                    la_spn2_status = 'error',
-                    la_spn2_last = %s
-                WHERE la_id = %s
-            """, (ts, la_id))
-
-        processed += 1
-
-    logger.info("Processed %d URLs, submitted %d to SPN2", processed, submitted)
-    conn.close()
-    return processed
+def run(config, batch=500, dry_run=False, refresh=False, concurrency=4):
+    """Check and submit URLs to Internet Archive.
+
+    refresh=True ignores the snapshot index and cached lookups and asks
+    CDX again for every URL. concurrency is the number of CDX workers;
+    SPN2 submissions are always made one at a time.
+    """
+    with connection(config) as conn:
+        ts = now_ts()
+
+        ia_access = config.get("ia_access_key")
+        ia_secret = config.get("ia_secret_key")
+        submit = bool(ia_access and ia_secret) and not dry_run
+
+        # Get URLs that haven't been checked with CDX recently
+        # or have never been submitted
+        rows = execute(conn, """
+            SELECT la_id, la_url, la_domain, la_spn2_status, la_wayback_ts
+            FROM faw_link_archive
+            WHERE la_is_dead = 0
+              AND (la_spn2_status = 'none' OR la_spn2_status = 'error')
+            ORDER BY la_spn2_last ASC, la_id ASC
+            LIMIT %s
+        """, (batch,))
+
+        if not rows:
+            logger.debug("No URLs need archival")
+            return 0
+
+        items = [{
+            "la_id": row.get("la_id", row.get(b"la_id")),
+            "url": _text(row.get("la_url", row.get(b"la_url"))),
+            "domain": _text(row.get("la_domain", row.get(b"la_domain"))),
+        } for row in rows]
+
+        # Step 0: bulk CDX listing for domains that dominate the batch
+        index = open_snapshot_index(config)
+        if index and not refresh:
+            per_domain = Counter(item["domain"] for item in items)
+            index.prefetch_domains(
+                [d for d, n in per_domain.most_common() if d and n >= PREFETCH_MIN_URLS]
+            )
+
+        # Every item ends up on `results` exactly once, as
+        # (item, snapshot, spn2 result or None, skipped)
+        to_submit = queue.Queue()
+        results = queue.Queue()
+        stop = threading.Event()  # set when the main thread stops recording results
+
+        def lookup(item):
+            # Step 1: CDX lookup (always free), local index first
+            if stop.is_set() or out_of_time():
+                results.put((item, None, None, True))
+                return
+            try:
+                snapshot = _find_snapshot(index, item["url"], item["domain"], refresh)
+            except Exception:
+                logger.exception("CDX lookup failed for %s", item["url"])
+                results.put((item, None, None, True))
+                return
+
+            if snapshot and _is_recent(snapshot["timestamp"], STALE_DAYS):
+                logger.debug("Recent snapshot exists for %s", item["url"])
+                results.put((item, snapshot, None, False))
+            elif submit:
+                to_submit.put((item, snapshot))
+            else:
+                if dry_run:
+                    logger.info("[DRY RUN] Would submit to SPN2: %s", item["url"])
+                else:
+                    logger.debug("No IA keys, skipping SPN2 for %s", item["url"])
+                results.put((item, snapshot, None, False))
+
+        def cdx_stage():
+            try:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    for _ in pool.map(lookup, items):
+                        pass
+            finally:
+                to_submit.put(None)
+
+        def spn2_stage():
+            # Step 2: SPN2 submission, paced by the shared service:spn2 bucket
+            while True:
+                work = to_submit.get()
+                if work is None:
+                    return
+                item, snapshot = work
+                if stop.is_set() or out_of_time():
+                    results.put((item, snapshot, None, True))
+                    continue
+                try:
+                    result = submit_spn2(item["url"], ia_access, ia_secret)
+                except Exception as e:
+                    logger.exception("SPN2 submission failed for %s", item["url"])
+                    result = {"success": False, "job_id": None, "error": str(e)}
+                results.put((item, snapshot, result, False))
+
+        stages = [threading.Thread(target=cdx_stage, name="cdx", daemon=True),
+                  threading.Thread(target=spn2_stage, name="spn2", daemon=True)]
+        for stage in stages:
+            stage.start()
+
+        processed = 0
+        submitted = 0
+        skipped = 0
+
+        try:
+            with BatchWriter(conn, size=FLUSH_SIZE, interval=FLUSH_SECONDS) as writer:
+                remaining = len(items)
+                while remaining:
+                    try:
+                        item, snapshot, result, was_skipped = results.get(timeout=IDLE_SECONDS)
+                    except queue.Empty:
+                        writer.flush_if_due()
+                        if not any(stage.is_alive() for stage in stages) and results.empty():
+                            logger.error("Archive pipeline stopped with %d URLs unaccounted for",
+                                         remaining)
+                            break
+                        continue
+                    remaining -= 1
+                    if was_skipped:
+                        skipped += 1
+                        continue
+
+                    wayback_url = snapshot["wayback_url"].encode("utf-8") if snapshot else None
+                    wayback_ts = snapshot["timestamp"].encode("utf-8") if snapshot else None
+
+                    if result is None:
+                        if snapshot:
+                            writer.add(SNAPSHOT_SQL, (wayback_url, wayback_ts, ts, item["la_id"]))
+                    elif result["success"]:
+                        job_id = result["job_id"]
+                        writer.add(SPN2_SQL, (
+                            wayback_url, wayback_ts, "pending",
+                            job_id.encode("utf-8") if job_id else None, ts, item["la_id"],
+                        ))
+                        submitted += 1
+                    else:
+                        writer.add(SPN2_SQL, (wayback_url, wayback_ts, "error", None, ts, item["la_id"]))
+
+                    processed += 1
+        finally:
+            # Nothing submitted after this point could have its job id recorded
+            stop.set()
+            for stage in stages:
+                stage.join()
+
+        if skipped:
+            logger.warning("Time budget spent, %d URLs left for the next run", skipped)
+        logger.info("Processed %d URLs, submitted %d to SPN2", processed, submitted)
+        get_lookup_cache().log_stats("submit-archive")
+        return processed
+
+
+def _find_snapshot(index, url, domain, refresh=False):
+    """Latest snapshot for url from the local index, falling back to CDX."""
+    if index and not refresh:
+        state, snapshot = index.lookup(url, domain)
+        if state == HIT:
+            return snapshot
+        if state == MISS:
+            return None
+    return cdx_lookup(url, refresh=refresh)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
 
 
 def _is_recent(wayback_ts, max_days):
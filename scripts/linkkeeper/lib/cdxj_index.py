@@ -0,0 +1,225 @@
+"""Local CDXJ replay index over the WARC records stored in R2.
+
+Every record snapshot-critical uploads is listed here as a CDXJ line,
+"<surt> <timestamp> {json}", whose JSON carries the R2 key, offset and
+length of the record, so our copy of a URL can be found without knowing
+its la_r2_key and fetched with a single byte-range GET.
+
+The index is a directory of sorted segment files under the state dir.
+Each upload adds one small segment (an atomic write, safe across
+processes); once there are more than MAX_SEGMENTS they are merged into
+one. lookup() binary-searches each segment through mmap, so it touches
+a handful of pages however large the index grows.
+"""
+
+import os
+import json
+import shutil
+import time
+import mmap
+import fcntl
+import contextlib
+import heapq
+import logging
+import tempfile
+import threading
+
+from .warc_writer import surt
+
+logger = logging.getLogger("linkkeeper.cdxj_index")
+
+MAX_SEGMENTS = 8     # merge segments once there are more than this
+REBUILD_BATCH = 200000  # lines per segment while rebuilding from R2
+SEGMENT_SUFFIX = ".cdxj"
+
+
+class CDXJIndex:
+    """Sorted, segmented CDXJ files with mmap binary-search lookups."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def segments(self):
+        return sorted(
+            os.path.join(self.path, name) for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def add_sidecar(self, key, text):
+        """Add the records of a WARC's sidecar index, stored under R2 key."""
+        lines = _keyed_lines(text, key)
+        if not lines:
+            return 0
+        lines.sort()
+        with self._lock:
+            self._write_segment(lines)
+            if len(self.segments()) > MAX_SEGMENTS:
+                self.compact()
+        return len(lines)
+
+    def _write_segment(self, lines, directory=None):
+        directory = directory or self.path
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            for line in lines:
+                fh.write(line + "\n")
+        name = f"seg-{time.time_ns()}-{os.getpid()}{SEGMENT_SUFFIX}"
+        os.replace(tmp, os.path.join(directory, name))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the index's cross-process lock."""
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def compact(self):
+        """Merge all segments into one; one process at a time."""
+        with self._locked():
+            segments = self.segments()
+            if len(segments) < 2:
+                return
+            files = [open(seg, "r", encoding="utf-8") for seg in segments]
+            try:
+                fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as out:
+                    last = None
+                    for line in heapq.merge(*files):
+                        if line != last:
+                            out.write(line)
+                        last = line
+            finally:
+                for fh in files:
+                    fh.close()
+            # Sorts first, so later segments from other processes stay after it
+            os.replace(tmp, os.path.join(self.path, f"seg-0-{time.time_ns()}{SEGMENT_SUFFIX}"))
+            for seg in segments:
+                os.remove(seg)
+            logger.info("Compacted %d CDXJ segments", len(segments))
+
+    def lookup(self, url, include_revisits=False):
+        """Latest record for url, or None.
+
+        Returns the record's JSON fields plus "urlkey" and "timestamp".
+        Revisit records are skipped unless include_revisits, since the
+        full record they refer to holds the same payload.
+        """
+        prefix = (surt(url) + " ").encode("utf-8")
+        try:
+            return self._lookup(prefix, include_revisits)
+        except FileNotFoundError:
+            # A compaction replaced the segments mid-lookup; list them again
+            return self._lookup(prefix, include_revisits)
+
+    def _lookup(self, prefix, include_revisits):
+        best = None
+        for seg in self.segments():
+            for line in _scan(seg, prefix):
+                urlkey, timestamp, fields = line.decode("utf-8").split(" ", 2)
+                fields = json.loads(fields)
+                if fields.get("mime") == "warc/revisit" and not include_revisits:
+                    continue
+                if best is None or timestamp > best["timestamp"]:
+                    fields.update(urlkey=urlkey, timestamp=timestamp)
+                    best = fields
+        return best
+
+    def rebuild(self, client, bucket, iter_objects, fetch):
+        """Recreate the index from every sidecar .cdxj in the bucket.
+
+        iter_objects/fetch are r2_client.iter_warcs/fetch_object. The new
+        segments are built in a scratch directory and only replace the
+        current ones once every sidecar has been read, so a failure
+        partway leaves the index as it was.
+        """
+        with self._lock:
+            replaced = self.segments()
+            scratch = tempfile.mkdtemp(dir=self.path, prefix=".rebuild-")
+            try:
+                added = 0
+                lines = []
+                for obj in iter_objects(client, bucket):
+                    if not obj["key"].endswith(".cdxj"):
+                        continue
+                    warc_key = obj["key"][:-len(".cdxj")] + ".warc.gz"
+                    lines.extend(_keyed_lines(fetch(client, bucket, obj["key"]).decode("utf-8"), warc_key))
+                    if len(lines) >= REBUILD_BATCH:
+                        lines.sort()
+                        self._write_segment(lines, scratch)
+                        added += len(lines)
+                        lines = []
+                if lines:
+                    lines.sort()
+                    self._write_segment(lines, scratch)
+                    added += len(lines)
+
+                # Segments added by uploads during the rebuild are kept
+                with self._locked():
+                    for name in sorted(os.listdir(scratch)):
+                        os.replace(os.path.join(scratch, name), os.path.join(self.path, name))
+                    for seg in replaced:
+                        try:
+                            os.remove(seg)
+                        except FileNotFoundError:
+                            pass  # merged away by another process's compaction
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+            self.compact()
+        return added
+
+
+def _keyed_lines(text, key):
+    """CDXJ lines of a sidecar index, with the WARC's R2 key added."""
+    lines = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        urlkey, timestamp, fields = line.split(" ", 2)
+        fields = json.loads(fields)
+        fields["key"] = key
+        lines.append(f"{urlkey} {timestamp} {json.dumps(fields, sort_keys=True)}")
+    return lines
+
+
+def _scan(path, prefix):
+    """Yield the lines of a sorted file that start with prefix."""
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Binary search for the first line >= prefix
+            lo, hi = 0, len(mm)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                start = mm.rfind(b"\n", 0, mid) + 1
+                end = mm.find(b"\n", start)
+                if end == -1:
+                    end = len(mm)
+                if mm[start:end] < prefix:
+                    lo = end + 1
+                else:
+                    hi = start
+
+            while lo < len(mm):
+                end = mm.find(b"\n", lo)
+                if end == -1:
+                    end = len(mm)
+                line = mm[lo:end]
+                if not line.startswith(prefix):
+                    return
+                yield line
+                lo = end + 1
+
+
+def open_cdxj_index(config):
+    """Open the index under config["state_dir"], or None if unavailable."""
+    state_dir = config.get("state_dir")
+    if not state_dir:
+        return None
+    try:
+        return CDXJIndex(os.path.join(state_dir, "cdxj"))
+    except OSError as e:
+        logger.warning("CDXJ index unavailable: %s", e)
+        return None
@@ -1,9 +1,17 @@
 """MariaDB connection helpers for LinkKeeper."""
 
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
 import pymysql
 import pymysql.cursors
 
+logger = logging.getLogger("linkkeeper.db")
+
 _pool = None
+_pool_lock = threading.Lock()
 
 
 def get_connection(config):
@@ -23,6 +31,83 @@ def get_connection(config):
     )
 
 
+class ConnectionPool:
+    """A small pool of autocommit connections, reused across jobs.
+
+    Connections are health-checked with ping(reconnect=True) when borrowed.
+    A connection whose with block raised is closed instead of being
+    returned to the pool, since it may still hold an open transaction or
+    an unread unbuffered result set.
+    """
+
+    def __init__(self, config, size=4):
+        self.config = config
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block."""
+        conn = self._borrow()
+        try:
+            yield conn
+        except BaseException:
+            self._discard(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def _borrow(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return get_connection(self.config)
+            try:
+                conn.ping(reconnect=True)
+                return conn
+            except pymysql.err.Error as e:
+                logger.debug("Dropping stale pooled connection: %s", e)
+                self._discard(conn)
+
+    def _release(self, conn):
+        if not conn.open:
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+def get_pool(config):
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(config, size=config.get("db_pool_size", 4))
+        return _pool
+
+
+def connection(config):
+    """Borrow a pooled connection: ``with connection(config) as conn: ...``"""
+    return get_pool(config).connection()
+
+
 def execute(conn, sql, params=None):
     """Execute a query and return all rows."""
     with conn.cursor() as cur:
@@ -30,6 +115,18 @@ def execute(conn, sql, params=None):
         return cur.fetchall()
 
 
+def stream(conn, sql, params=None):
+    """Execute a query through an unbuffered server-side cursor, yielding rows.
+
+    Rows are read off the socket as they are consumed, so memory use does
+    not depend on the size of the result set. The connection cannot run
+    other queries until the generator is exhausted.
+    """
+    with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
+        cur.execute(sql, params)
+        yield from cur
+
+
 def execute_one(conn, sql, params=None):
     """Execute a query and return one row."""
     with conn.cursor() as cur:
@@ -45,14 +142,104 @@ def execute_insert(conn, sql, params=None):
 
 
 def execute_many(conn, sql, params_list):
-    """Execute a query with many parameter sets."""
+    """Execute a query with many parameter sets.
+
+    For INSERT ... VALUES (...) [ON DUPLICATE KEY UPDATE ...] statements
+    pymysql rewrites the parameter sets into multi-row statements, so a
+    bulk upsert costs one round trip per ~1MB of SQL instead of one per row.
+    """
     with conn.cursor() as cur:
         cur.executemany(sql, params_list)
         return cur.rowcount
 
 
+@contextmanager
+def transaction(conn):
+    """Run a block of statements as one transaction on an autocommit connection."""
+    conn.begin()
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+class BatchWriter:
+    """Buffer parameter sets per statement and write them in groups.
+
+    A flush runs each statement's buffered rows through execute_many inside
+    one transaction. It happens once `size` rows are pending or `interval`
+    seconds have passed since the last flush, so a crash loses at most one
+    flush window. Use as a context manager to flush on exit.
+
+    There is no timer thread (the connection belongs to the caller's
+    thread): the interval is checked on add(), and callers that block
+    waiting for work call flush_if_due() while they wait.
+    """
+
+    def __init__(self, conn, size=200, interval=5.0):
+        self.conn = conn
+        self.size = size
+        self.interval = interval
+        self.written = 0
+        self._pending = {}
+        self._count = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, sql, params):
+        self._pending.setdefault(sql, []).append(params)
+        self._count += 1
+        if self._count >= self.size:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush if rows are pending and `interval` has passed since the last flush."""
+        if self._pending and time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with transaction(self.conn):
+                for sql, params_list in self._pending.items():
+                    execute_many(self.conn, sql, params_list)
+            self.written += self._count
+        self._pending = {}
+        self._count = 0
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+
+def chunked(seq, size):
+    """Yield successive lists of at most size items from seq."""
+    chunk = []
+    for item in seq:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def now_ts():
     """Return current UTC timestamp in MediaWiki format (YYYYMMDDHHmmss)."""
     from datetime import datetime, timezone
 
     return datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+
+
+def ts_in(seconds):
+    """Return the UTC timestamp `seconds` from now in MediaWiki format."""
+    from datetime import datetime, timezone, timedelta
+
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).strftime("%Y%m%d%H%M%S")
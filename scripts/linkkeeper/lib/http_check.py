@@ -2,16 +2,23 @@
 
 import re
 import time
+import uuid
+import zlib
+import socket
 import logging
-from collections import defaultdict
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
 
-logger = logging.getLogger("linkkeeper.http_check")
+from .ratelimit import get_limiter
 
-# Per-domain rate limiting: max 2 req/sec
-_domain_last_request = defaultdict(float)
-_DOMAIN_MIN_INTERVAL = 0.5  # seconds between requests to same domain
+logger = logging.getLogger("linkkeeper.http_check")
 
 SOFT_404_PATTERNS = re.compile(
     r"page\s*not\s*found|"
@@ -23,6 +30,35 @@ SOFT_404_PATTERNS = re.compile(
     re.IGNORECASE,
 )
 
+# Soft-404 detection reads at most this much of a response body
+SOFT_404_READ_BYTES = 16 * 1024
+SOFT_404_SMALL_PAGE = 1024      # "not found" wording only counts on pages this small
+
+# Per-domain "not found" fingerprints, from probing a random missing path
+_FINGERPRINT_TTL = 24 * 3600    # seconds before a domain is probed again
+_FINGERPRINT_RETRY = 15 * 60    # seconds before a failed probe is retried
+_FINGERPRINT_SIZE = 64          # bottom-k sketch size
+_FINGERPRINT_SIMILARITY = 0.95  # sketch overlap that counts as the same page
+_FINGERPRINT_LENGTH_RATIO = 0.9 # and body lengths within 10% of each other
+_fingerprints = {}              # domain -> (expires, fingerprint or None)
+_fingerprint_lock = threading.Lock()
+
+# Per-domain circuit breaker: after BREAKER_THRESHOLD connection-level
+# failures in a row (DNS, refused, connect timeout) the domain is "open" and
+# its remaining URLs get the shared verdict without a request. After
+# BREAKER_COOLDOWN one half-open probe is let through; success closes it.
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 30 * 60
+_breakers = {}  # domain -> {"failures", "opened_at", "error", "probing"}
+_breaker_lock = threading.Lock()
+
+# DNS cache for the pooled sessions' connections only (see get_session).
+# Failed lookups are not cached; the circuit breaker covers dead hosts.
+DNS_TTL = 300           # seconds to reuse a successful lookup
+DNS_CACHE_MAX = 4096    # (host, port) entries kept, least recently used evicted
+_dns_cache = OrderedDict()  # (host, port) -> (expires, [addresses])
+_dns_lock = threading.Lock()
+
 USER_AGENT = (
     "LinkKeeper/1.0 (https://flowarts.wiki; link preservation bot) "
     "Mozilla/5.0 (compatible)"
@@ -31,14 +67,188 @@ USER_AGENT = (
 # Domains known to block HEAD requests
 HEAD_BLACKLIST = {"tumblr.com", "wordpress.com", "blogspot.com"}
 
+# Keep-alive sessions, one per host, shared by health checks, Wayback
+# lookups and WARC capture so same-host requests reuse warm connections.
+_SESSION_POOL_MAX = 64      # hosts with a warm session at once (LRU beyond)
+_SESSION_IDLE_TTL = 300     # seconds before an unused session is closed
+_SESSION_CONNECTIONS = 4    # keep-alive connections per host
+_sessions = OrderedDict()   # host -> (session, last_used)
+_session_lock = threading.Lock()
+
+
+def get_session(url):
+    """Return the shared keep-alive requests.Session for a URL's host."""
+    host = (urlparse(url).hostname or "").lower()
+    now = time.monotonic()
+    evicted = []
+
+    with _session_lock:
+        for key in list(_sessions):
+            if now - _sessions[key][1] > _SESSION_IDLE_TTL:
+                evicted.append(_sessions.pop(key)[0])
+
+        if host in _sessions:
+            session = _sessions.pop(host)[0]
+        else:
+            session = requests.Session()
+            adapter = _CachedDNSAdapter(
+                pool_connections=1,
+                pool_maxsize=_SESSION_CONNECTIONS,
+                pool_block=False,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+        _sessions[host] = (session, now)
+
+        while len(_sessions) > _SESSION_POOL_MAX:
+            evicted.append(_sessions.popitem(last=False)[1][0])
+
+    for old in evicted:
+        old.close()
+    return session
+
+
+def close_sessions():
+    """Close every pooled session."""
+    with _session_lock:
+        sessions = [s for s, _ in _sessions.values()]
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
 
 def _rate_limit(domain):
-    """Sleep if needed to respect per-domain rate limit."""
+    """Block until the shared per-domain bucket allows another request."""
+    get_limiter().acquire(f"domain:{domain}")
+
+
+def _resolve(host, port):
+    """Addresses for host from the DNS cache, looked up on a miss; None if the lookup fails."""
+    key = (host, port)
     now = time.monotonic()
-    elapsed = now - _domain_last_request[domain]
-    if elapsed < _DOMAIN_MIN_INTERVAL:
-        time.sleep(_DOMAIN_MIN_INTERVAL - elapsed)
-    _domain_last_request[domain] = time.monotonic()
+    with _dns_lock:
+        cached = _dns_cache.get(key)
+        if cached and cached[0] > now:
+            _dns_cache.move_to_end(key)
+            return cached[1]
+
+    try:
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return None
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    with _dns_lock:
+        _dns_cache[key] = (now + DNS_TTL, addresses)
+        _dns_cache.move_to_end(key)
+        while len(_dns_cache) > DNS_CACHE_MAX:
+            _dns_cache.popitem(last=False)
+    return addresses
+
+
+class _CachedDNSMixin:
+    """Connect through the DNS cache, trying each cached address in turn.
+
+    The hostname is still used for the Host header, SNI and certificate
+    checks; only the address connected to comes from the cache.
+    """
+
+    def _new_conn(self):
+        host = self._dns_host
+        addresses = _resolve(host, self.port)
+        if not addresses:
+            return super()._new_conn()  # a real lookup reports the failure
+        error = None
+        for address in addresses:
+            self._dns_host = address
+            try:
+                return super()._new_conn()
+            except (NewConnectionError, ConnectTimeoutError) as e:
+                error = e
+            finally:
+                self._dns_host = host
+        raise error
+
+
+class _CachedDNSConnection(_CachedDNSMixin, HTTPConnection):
+    pass
+
+
+class _CachedDNSHTTPSConnection(_CachedDNSMixin, HTTPSConnection):
+    pass
+
+
+class _CachedDNSPool(HTTPConnectionPool):
+    ConnectionCls = _CachedDNSConnection
+
+
+class _CachedDNSHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _CachedDNSHTTPSConnection
+
+
+class _CachedDNSAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections resolve hosts through the DNS cache."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CachedDNSPool,
+            "https": _CachedDNSHTTPSPool,
+        }
+
+
+def _breaker_verdict(domain):
+    """Return the shared error if the domain's breaker is open, else None.
+
+    Once the cooldown has passed, the first caller is let through as the
+    half-open probe while everyone else keeps getting the verdict.
+    """
+    with _breaker_lock:
+        breaker = _breakers.get(domain)
+        if not breaker or breaker["opened_at"] is None:
+            return None
+        if time.monotonic() - breaker["opened_at"] >= BREAKER_COOLDOWN and not breaker["probing"]:
+            breaker["probing"] = True
+            return None
+        return breaker["error"]
+
+
+def _breaker_record(domain, error=None):
+    """Record a request outcome: error for connection-level failures, None for success."""
+    with _breaker_lock:
+        if error is None:
+            if domain in _breakers:
+                if _breakers[domain]["opened_at"] is not None:
+                    logger.info("Circuit closed for %s", domain)
+                del _breakers[domain]
+            return
+
+        breaker = _breakers.setdefault(
+            domain, {"failures": 0, "opened_at": None, "error": None, "probing": False}
+        )
+        breaker["failures"] += 1
+        breaker["error"] = error
+        if breaker["probing"] or (
+            breaker["opened_at"] is None and breaker["failures"] >= BREAKER_THRESHOLD
+        ):
+            if breaker["opened_at"] is None:
+                logger.warning("Circuit open for %s after %d failures: %s",
+                               domain, breaker["failures"], error)
+            breaker["opened_at"] = time.monotonic()
+            breaker["probing"] = False
+
+
+def _is_connect_failure(error):
+    """True if a requests.ConnectionError never reached the host.
+
+    That is a DNS failure, a refused connection or a connect timeout, as
+    opposed to a connection the server dropped or reset mid-request.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)  # urllib3 MaxRetryError
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
 
 
 def _should_skip_head(domain):
@@ -46,96 +256,273 @@ def _should_skip_head(domain):
     return any(domain.endswith(d) for d in HEAD_BLACKLIST)
 
 
-def check_url(url, domain=None, timeout=15):
+def _record_validators(result, resp):
+    """Copy ETag / Last-Modified / Content-Length from a response."""
+    result["etag"] = resp.headers.get("ETag")
+    result["last_modified"] = resp.headers.get("Last-Modified")
+    content_length = resp.headers.get("Content-Length")
+    if content_length and content_length.isdigit():
+        result["content_length"] = int(content_length)
+
+
+def _read_prefix(resp, limit=SOFT_404_READ_BYTES):
+    """Read at most `limit` bytes of a streamed body and decode them."""
+    chunks = []
+    size = 0
+    for chunk in resp.iter_content(chunk_size=4096):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            break
+    raw = b"".join(chunks)[:limit]
+    return raw.decode(resp.encoding or "utf-8", errors="replace"), len(raw)
+
+
+def _sketch(text):
+    """Bottom-k sketch of a page's visible word 3-shingles."""
+    text = re.sub(r"(?is)<(script|style)\b.*?</\1>", " ", text)
+    text = re.sub(r"<[^>]+>", " ", text)
+    words = re.findall(r"[a-z]+", text.lower())
+    shingles = {
+        zlib.crc32(" ".join(words[i:i + 3]).encode("utf-8"))
+        for i in range(max(1, len(words) - 2))
+    }
+    return frozenset(sorted(shingles)[:_FINGERPRINT_SIZE])
+
+
+def _similarity(a, b):
+    """Estimate Jaccard similarity of two bottom-k sketches."""
+    if not a or not b:
+        return 0.0
+    union = sorted(a | b)[:_FINGERPRINT_SIZE]
+    return sum(1 for h in union if h in a and h in b) / len(union)
+
+
+def _domain_fingerprint(url, domain, session, timeout):
+    """Return the domain's soft-404 fingerprint, probing it if not cached.
+
+    The probe requests a random path that cannot exist. A proper 4xx means
+    the domain reports missing pages honestly and the fingerprint is None;
+    a 2xx means it serves a "not found" page (or a redirect) with a success
+    status, and the fingerprint records what that page looks like. If the
+    homepage looks the same too (the site serves one page for every path,
+    or sends missing paths to the homepage), the page content can't tell
+    missing from real and only the redirect target is kept.
+    """
+    now = time.monotonic()
+    with _fingerprint_lock:
+        cached = _fingerprints.get(domain)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    parsed = urlparse(url)
+    probe_url = f"{parsed.scheme}://{parsed.netloc}/linkkeeper-{uuid.uuid4().hex}"
+    fingerprint = None
+    ttl = _FINGERPRINT_TTL
+    try:
+        _rate_limit(domain)
+        with session.get(probe_url, timeout=timeout, allow_redirects=True, stream=True) as resp:
+            if resp.status_code < 300:
+                text, length = _read_prefix(resp)
+                fingerprint = {
+                    "final_url": resp.url if resp.url != probe_url else None,
+                    "sketch": _sketch(text),
+                    "length": length,
+                }
+                logger.debug("Domain %s serves soft 404s (probe HTTP %d)", domain, resp.status_code)
+
+        if fingerprint:
+            home_url = f"{parsed.scheme}://{parsed.netloc}/"
+            _rate_limit(domain)
+            with session.get(home_url, timeout=timeout, allow_redirects=True, stream=True) as resp:
+                if resp.status_code < 300:
+                    text, length = _read_prefix(resp)
+                    if _same_page(fingerprint, text, length):
+                        logger.debug("Domain %s serves the same page for every path", domain)
+                        fingerprint["sketch"] = None
+            if not fingerprint["final_url"] and fingerprint["sketch"] is None:
+                fingerprint = None
+    except requests.ConnectionError as e:
+        if _is_connect_failure(e):
+            raise  # the host is unreachable; check_url reports it
+        logger.debug("Soft-404 probe failed for %s: %s", domain, e)
+        fingerprint = None
+        ttl = _FINGERPRINT_RETRY
+    except requests.RequestException as e:
+        # Leave it unprobed for a while; the real check will surface the failure
+        logger.debug("Soft-404 probe failed for %s: %s", domain, e)
+        fingerprint = None
+        ttl = _FINGERPRINT_RETRY
+
+    with _fingerprint_lock:
+        _fingerprints[domain] = (now + ttl, fingerprint)
+    return fingerprint
+
+
+def _same_page(fingerprint, text, length):
+    """True if a body looks like the fingerprinted "not found" page."""
+    longer = max(length, fingerprint["length"]) or 1
+    if min(length, fingerprint["length"]) / longer < _FINGERPRINT_LENGTH_RATIO:
+        return False
+    return _similarity(_sketch(text), fingerprint["sketch"]) >= _FINGERPRINT_SIMILARITY
+
+
+def _matches_fingerprint(fingerprint, url, final_url, text, length):
+    """True if the response for url looks like the domain's "not found" page."""
+    target = fingerprint["final_url"]
+    # Only a redirect to the "not found" target counts; that target itself
+    # and the homepage (which may redirect there too) are real pages
+    if (target and final_url == target and final_url != url and url != target
+            and urlparse(url).path not in ("", "/")):
+        return True
+    if fingerprint["sketch"] is None:
+        return False
+    return _same_page(fingerprint, text, length)
+
+
+def _fetch(url, domain, session, headers, result, timeout):
+    """Run the HEAD/GET sequence for check_url, filling in result."""
+    fingerprint = _domain_fingerprint(url, domain, session, timeout)
+
+    # Try HEAD first (cheaper), fall back to GET. A domain that answers
+    # missing pages with 2xx needs the body, so it always gets a GET.
+    if fingerprint is None and not _should_skip_head(domain):
+        try:
+            resp = session.head(
+                url,
+                headers=headers,
+                timeout=timeout,
+                allow_redirects=True,
+            )
+            if resp.status_code < 400:
+                result["status"] = resp.status_code
+                result["alive"] = True
+                result["not_modified"] = resp.status_code == 304
+                _record_validators(result, resp)
+                if resp.url != url:
+                    result["redirect_url"] = resp.url
+                return
+            # If HEAD returns error, try GET (some servers reject HEAD)
+            if resp.status_code == 405:
+                pass  # fall through to GET
+            else:
+                result["status"] = resp.status_code
+                return
+        except requests.ConnectionError as e:
+            if _is_connect_failure(e):
+                raise  # GET would fail the same way
+            # Dropped or reset connections: some servers do that to HEAD
+        except requests.RequestException:
+            pass  # fall through to GET
+
+    # GET request
+    resp = session.get(
+        url,
+        headers=headers,
+        timeout=timeout,
+        allow_redirects=True,
+        stream=True,
+    )
+    # Close the streamed response so its connection returns to the pool
+    try:
+        result["status"] = resp.status_code
+
+        if resp.url != url:
+            result["redirect_url"] = resp.url
+
+        if resp.status_code >= 400:
+            return
+
+        _record_validators(result, resp)
+        if resp.status_code == 304:
+            result["alive"] = True
+            result["not_modified"] = True
+            return
+
+        # Soft 404 detection on a bounded prefix of the body
+        text, length = _read_prefix(resp)
+        content_length = result["content_length"]
+        small = length < SOFT_404_SMALL_PAGE and (
+            content_length is None or content_length < SOFT_404_SMALL_PAGE
+        )
+        if small and SOFT_404_PATTERNS.search(text):
+            result["soft_404"] = True
+            return
+
+        if fingerprint and _matches_fingerprint(fingerprint, url, resp.url, text, length):
+            result["soft_404"] = True
+            return
+
+        result["alive"] = True
+    finally:
+        resp.close()
+
+
+def check_url(url, domain=None, timeout=15, etag=None, last_modified=None):
     """Check if a URL is alive.
 
+    If the validators from a previous check are given, the request is
+    conditional (If-None-Match / If-Modified-Since) and an unchanged page
+    comes back as a cheap 304 with not_modified set.
+
     Returns dict with:
         status: HTTP status code (0 for connection error)
         alive: bool
         soft_404: bool
+        not_modified: bool, True on a 304 revalidation
         redirect_url: final URL if redirected, else None
+        etag, last_modified, content_length: validators to store, or None
         error: error message if connection failed
+        short_circuited: True if the domain's circuit breaker was open and
+            no request was made (error carries the shared verdict)
     """
     if domain is None:
         from .url_normalize import extract_domain
         domain = extract_domain(url)
 
-    _rate_limit(domain)
-
-    headers = {"User-Agent": USER_AGENT}
     result = {
         "status": 0,
         "alive": False,
         "soft_404": False,
+        "not_modified": False,
         "redirect_url": None,
+        "etag": None,
+        "last_modified": None,
+        "content_length": None,
         "error": None,
+        "short_circuited": False,
     }
 
-    try:
-        # Try HEAD first (cheaper), fall back to GET
-        if not _should_skip_head(domain):
-            try:
-                resp = requests.head(
-                    url,
-                    headers=headers,
-                    timeout=timeout,
-                    allow_redirects=True,
-                )
-                if resp.status_code < 400:
-                    result["status"] = resp.status_code
-                    result["alive"] = True
-                    if resp.url != url:
-                        result["redirect_url"] = resp.url
-                    return result
-                # If HEAD returns error, try GET (some servers reject HEAD)
-                if resp.status_code == 405:
-                    pass  # fall through to GET
-                else:
-                    result["status"] = resp.status_code
-                    return result
-            except requests.RequestException:
-                pass  # fall through to GET
+    verdict = _breaker_verdict(domain)
+    if verdict is not None:
+        result["error"] = verdict
+        result["short_circuited"] = True
+        return result
 
-        # GET request
-        resp = requests.get(
-            url,
-            headers=headers,
-            timeout=timeout,
-            allow_redirects=True,
-            stream=True,
-        )
-        result["status"] = resp.status_code
-
-        if resp.url != url:
-            result["redirect_url"] = resp.url
-
-        if resp.status_code >= 400:
-            return result
-
-        # Soft 404 detection: check small pages for "not found" language
-        content_length = resp.headers.get("Content-Length")
-        if content_length and int(content_length) < 1024:
-            body = resp.text[:1024]
-            if SOFT_404_PATTERNS.search(body):
-                result["soft_404"] = True
-                result["alive"] = False
-                return result
-
-        # If no Content-Length header, read a chunk
-        if content_length is None:
-            body = resp.text[:2048]
-            if len(body) < 1024 and SOFT_404_PATTERNS.search(body):
-                result["soft_404"] = True
-                result["alive"] = False
-                return result
+    _rate_limit(domain)
 
-        result["alive"] = True
+    session = get_session(url)
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
 
+    try:
+        _fetch(url, domain, session, headers, result, timeout)
     except requests.ConnectionError as e:
         result["error"] = f"Connection error: {e}"
+        # Only DNS failures, refused connections and connect timeouts
+        # count towards the breaker; a dropped connection means the host
+        # is there
+        if _is_connect_failure(e):
+            _breaker_record(domain, result["error"])
+            return result
     except requests.Timeout:
         result["error"] = "Timeout"
     except requests.RequestException as e:
         result["error"] = str(e)
 
+    # The host answered (even if slowly or with an error status)
+    _breaker_record(domain)
     return result
@@ -0,0 +1,106 @@
+"""Bulk writes of discovered links into faw_link_archive / faw_link_page.
+
+Page membership lives in the faw_link_page junction table, one row per
+(link, page) pair. Recording that a page links to a URL is an idempotent
+INSERT IGNORE of a single row rather than a rewrite of a page list.
+"""
+
+from .db import execute, execute_many, chunked
+
+LOOKUP_CHUNK = 1000  # keys per SELECT ... IN (...) statement
+
+
+def add_link(links, normalized, h, domain, page_id):
+    """Collapse a (url, page) pair into links, keyed by la_url_hash."""
+    if h not in links:
+        links[h] = (normalized, domain, set())
+    links[h][2].add(page_id)
+
+
+def upsert_links(conn, links, ts):
+    """Write collapsed links and their page memberships with bulk statements.
+
+    links maps la_url_hash -> (normalized_url, domain, {page_id, ...}).
+    Returns (new_urls, new_page_links).
+    """
+    if not links:
+        return 0, 0
+
+    ids = link_ids(conn, list(links))
+    missing = [h for h in links if h not in ids]
+
+    new_urls = 0
+    if missing:
+        new_urls = execute_many(conn, """
+            INSERT IGNORE INTO faw_link_archive
+                (la_url, la_url_hash, la_domain, la_first_seen)
+            VALUES (%s, %s, %s, %s)
+        """, [
+            (links[h][0].encode("utf-8"), h, links[h][1].encode("utf-8"), ts)
+            for h in missing
+        ])
+        ids.update(link_ids(conn, missing))
+
+    pairs = [
+        (ids[h], page_id)
+        for h, (_, _, page_ids) in links.items()
+        if h in ids
+        for page_id in sorted(page_ids)
+    ]
+    new_page_links = 0
+    if pairs:
+        new_page_links = execute_many(conn, """
+            INSERT IGNORE INTO faw_link_page (lp_la_id, lp_page_id)
+            VALUES (%s, %s)
+        """, pairs)
+
+    return new_urls, new_page_links
+
+
+def link_ids(conn, hashes):
+    """Return {la_url_hash: la_id} for the hashes already archived."""
+    found = {}
+    for chunk in chunked(hashes, LOOKUP_CHUNK):
+        placeholders = ",".join(["%s"] * len(chunk))
+        rows = execute(conn, f"""
+            SELECT la_id, la_url_hash FROM faw_link_archive
+            WHERE la_url_hash IN ({placeholders})
+        """, tuple(chunk))
+        for row in rows:
+            h = row.get("la_url_hash", row.get(b"la_url_hash"))
+            found[bytes(h)] = row.get("la_id", row.get(b"la_id"))
+    return found
+
+
+def page_ids_for_links(conn, la_ids):
+    """Return {la_id: [page_id, ...]} for the given links."""
+    found = {}
+    for chunk in chunked(la_ids, LOOKUP_CHUNK):
+        placeholders = ",".join(["%s"] * len(chunk))
+        rows = execute(conn, f"""
+            SELECT lp_la_id, lp_page_id FROM faw_link_page
+            WHERE lp_la_id IN ({placeholders})
+            ORDER BY lp_la_id ASC, lp_page_id ASC
+        """, tuple(chunk))
+        for row in rows:
+            la_id = row.get("lp_la_id", row.get(b"lp_la_id"))
+            found.setdefault(la_id, []).append(row.get("lp_page_id", row.get(b"lp_page_id")))
+    return found
+
+
+def links_on_page(conn, page_id):
+    """Return the la_ids of all archived links on a page."""
+    rows = execute(conn, """
+        SELECT lp_la_id FROM faw_link_page
+        WHERE lp_page_id = %s
+    """, (page_id,))
+    return [row.get("lp_la_id", row.get(b"lp_la_id")) for row in rows]
+
+
+def parse_page_ids(raw):
+    """Parse a legacy comma-separated la_page_ids blob."""
+    if not raw:
+        return set()
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8", errors="replace")
+    return {int(x) for x in raw.split(",") if x.strip().isdigit()}
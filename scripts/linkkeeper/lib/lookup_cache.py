@@ -0,0 +1,142 @@
+"""Persistent TTL cache for Wayback lookups (CDX and availability API).
+
+The same URL gets looked up by every submit-archive run and again by
+remediate-dead, so results are kept in a SQLite file under the state
+directory. Both outcomes are cached: a snapshot for POSITIVE_TTL, and
+"no snapshot" for the shorter NEGATIVE_TTL since IA may capture the URL
+at any time. Lookup errors are never cached. Entries carry a last-used
+time and the least recently used are evicted once the cache grows past
+MAX_ENTRIES.
+
+Callers bypass reads with refresh=True (the --refresh CLI flag); fresh
+results are still written back.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger("linkkeeper.lookup_cache")
+
+POSITIVE_TTL = 7 * 86400   # seconds to trust a found snapshot
+NEGATIVE_TTL = 86400       # seconds to trust "no snapshot"
+MAX_ENTRIES = 200000       # LRU eviction above this many entries
+EVICT_EVERY = 500          # check the size once per this many writes
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class LookupCache:
+    """(kind, key) -> JSON value or None, in SQLite (a file or in memory)."""
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = Counter()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", timeout=10,
+                                   check_same_thread=False)
+        if path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS lookups (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                expires REAL NOT NULL,
+                used REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_lookups_used ON lookups (used);
+        """)
+
+    def get(self, kind, key):
+        """Return (True, value) on a live entry, else (False, None)."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires FROM lookups WHERE kind = ? AND key = ?",
+                (kind, key),
+            ).fetchone()
+            if not row or row[1] <= now:
+                self.stats[f"{kind}_miss"] += 1
+                return False, None
+            with self._db:
+                self._db.execute(
+                    "UPDATE lookups SET used = ? WHERE kind = ? AND key = ?",
+                    (now, kind, key),
+                )
+        self.stats[f"{kind}_hit"] += 1
+        return True, json.loads(row[0]) if row[0] is not None else None
+
+    def put(self, kind, key, value):
+        """Cache a lookup result; None means "looked, nothing there"."""
+        now = time.time()
+        ttl = POSITIVE_TTL if value is not None else NEGATIVE_TTL
+        encoded = json.dumps(value) if value is not None else None
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO lookups (kind, key, value, expires, used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (kind, key, encoded, now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM lookups WHERE expires <= ?", (now,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM lookups").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute("""
+                DELETE FROM lookups WHERE rowid IN (
+                    SELECT rowid FROM lookups ORDER BY used LIMIT ?
+                )
+            """, (excess,))
+            logger.info("Evicted %d least recently used lookups", excess)
+
+    def log_stats(self, job):
+        """Log and reset the hit/miss counters for the job that just ran."""
+        if not self.stats:
+            return
+        parts = []
+        for kind in sorted({k.rsplit("_", 1)[0] for k in self.stats}):
+            parts.append(f"{kind} {self.stats[kind + '_hit']} hit / "
+                         f"{self.stats[kind + '_miss']} miss")
+        logger.info("%s lookup cache: %s", job, ", ".join(parts))
+        self.stats.clear()
+
+
+def configure(config):
+    """Build the process-wide cache under config["state_dir"]."""
+    global _cache
+    path = None
+    if config.get("state_dir"):
+        path = os.path.join(config["state_dir"], "lookups.sqlite3")
+    try:
+        cache = LookupCache(path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Lookup cache state unavailable (%s), caching in memory", e)
+        cache = LookupCache(None)
+    with _cache_lock:
+        _cache = cache
+    return _cache
+
+
+def get_lookup_cache():
+    """Return the process-wide cache (in-memory until configure() is called)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LookupCache()
+        return _cache
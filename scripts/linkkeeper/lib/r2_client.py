@@ -1,12 +1,33 @@
-"""Cloudflare R2 (S3-compatible) upload client for WARC snapshots."""
+"""Cloudflare R2 (S3-compatible) upload client for WARC snapshots.
+
+Files go up through upload_warc with a tuned TransferConfig. WARCs can
+also be streamed straight to R2 with MultipartUpload, a writable stream
+that cuts what is written into equal-sized parts (R2 requires that) and
+uploads them on a BackgroundUploader, so writing the next record
+overlaps with uploading the previous part and nothing touches disk.
+"""
 
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config as BotoConfig
 
 logger = logging.getLogger("linkkeeper.r2")
 
+PART_SIZE = 8 * 1024 * 1024   # multipart part size (R2: all but the last part equal)
+UPLOAD_WORKERS = 2            # parts uploading at once
+UPLOAD_QUEUE = 2              # parts buffered beyond those before writers block
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=PART_SIZE,
+    multipart_chunksize=PART_SIZE,
+    max_concurrency=4,
+    use_threads=True,
+)
+
 
 def get_r2_client(config):
     """Create a boto3 S3 client configured for Cloudflare R2."""
@@ -23,8 +44,8 @@ def get_r2_client(config):
     )
 
 
-def upload_warc(client, bucket, key, file_path):
-    """Upload a WARC file to R2.
+def upload_warc(client, bucket, key, file_path, content_type="application/warc"):
+    """Upload a WARC file (or its CDXJ index) to R2.
 
     Returns dict with:
         success: bool
@@ -41,7 +62,8 @@ def upload_warc(client, bucket, key, file_path):
             file_path,
             bucket,
             key,
-            ExtraArgs={"ContentType": "application/warc"},
+            ExtraArgs={"ContentType": content_type},
+            Config=TRANSFER_CONFIG,
         )
         result["success"] = True
         result["size"] = file_size
@@ -53,19 +75,166 @@ def upload_warc(client, bucket, key, file_path):
     return result
 
 
+def upload_bytes(client, bucket, key, data, content_type):
+    """Upload a small in-memory object (e.g. a CDXJ index) to R2.
+
+    Returns dict with success, size and error like upload_warc.
+    """
+    result = {"success": False, "size": 0, "error": None}
+    try:
+        client.put_object(Bucket=bucket, Key=key, Body=data, ContentType=content_type)
+        result["success"] = True
+        result["size"] = len(data)
+    except Exception as e:
+        result["error"] = str(e)
+        logger.error("R2 upload failed for %s: %s", key, e)
+    return result
+
+
+class BackgroundUploader:
+    """Thread pool for part uploads with a bound on queued work.
+
+    submit() blocks once workers + queue parts are outstanding, which
+    caps the memory held by parts waiting to be sent.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, queue=UPLOAD_QUEUE):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="r2-upload")
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def submit(self, fn, *args):
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+class MultipartUpload:
+    """Write-only stream to an R2 object, uploaded in parts as it fills.
+
+    The multipart upload is only started once a full part has been
+    written; anything smaller goes up with a single put_object on close().
+    close() raises if any part failed (after aborting the upload); abort()
+    discards everything written so far.
+    """
+
+    def __init__(self, client, bucket, key, uploader, content_type="application/warc",
+                 part_size=PART_SIZE):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.size = 0
+        self._uploader = uploader
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []  # futures, in part number order
+
+    def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._send(part)
+        return len(data)
+
+    def _send(self, body):
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type,
+            )["UploadId"]
+        number = len(self._parts) + 1
+        self._parts.append(self._uploader.submit(self._upload_part, number, body))
+
+    def _upload_part(self, number, body):
+        resp = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=number, Body=body,
+        )
+        return {"PartNumber": number, "ETag": resp["ETag"]}
+
+    def close(self):
+        """Finish the object; returns its size."""
+        try:
+            if self._upload_id is None:
+                self.client.put_object(
+                    Bucket=self.bucket, Key=self.key,
+                    Body=bytes(self._buffer), ContentType=self.content_type,
+                )
+            else:
+                if self._buffer:
+                    self._send(bytes(self._buffer))
+                parts = [future.result() for future in self._parts]
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+        except Exception:
+            self.abort()
+            raise
+        self._buffer = bytearray()
+        self._upload_id = None  # complete: a later abort() has nothing to cancel
+        logger.info("Uploaded %d bytes to r2://%s/%s", self.size, self.bucket, self.key)
+        return self.size
+
+    def abort(self):
+        """Drop the object, cancelling any parts already uploaded."""
+        self._buffer = bytearray()
+        for future in self._parts:
+            future.exception()  # wait; failures are moot once aborted
+        if self._upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                )
+            except Exception as e:
+                logger.warning("Could not abort upload of %s: %s", self.key, e)
+            self._upload_id = None
+        self._parts = []
+
+
+def iter_warcs(client, bucket, prefix="warcs/"):
+    """Yield objects under prefix one listing page at a time.
+
+    Unlike list_warcs this never holds the whole listing, and raises on
+    failure instead of returning a partial result.
+    """
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield {
+                "key": obj["Key"],
+                "size": obj["Size"],
+                "modified": obj["LastModified"].isoformat(),
+            }
+
+
 def list_warcs(client, bucket, prefix="warcs/"):
     """List WARC files in the R2 bucket."""
     try:
-        paginator = client.get_paginator("list_objects_v2")
-        keys = []
-        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-            for obj in page.get("Contents", []):
-                keys.append({
-                    "key": obj["Key"],
-                    "size": obj["Size"],
-                    "modified": obj["LastModified"].isoformat(),
-                })
-        return keys
+        return list(iter_warcs(client, bucket, prefix))
     except Exception as e:
         logger.error("R2 list failed: %s", e)
         return []
+
+
+def fetch_object(client, bucket, key):
+    """Return the full body of a (small) object, e.g. a CDXJ index."""
+    return client.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+
+def fetch_record(client, bucket, key, offset, length):
+    """Fetch one gzip-member WARC record with a byte-range GET."""
+    resp = client.get_object(
+        Bucket=bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}",
+    )
+    return resp["Body"].read()
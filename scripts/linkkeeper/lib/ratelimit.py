@@ -0,0 +1,183 @@
+"""Token-bucket rate limiting shared across LinkKeeper processes.
+
+Bucket state lives in a small SQLite file under the state directory, so
+overlapping jobs (or a daemon and a manual CLI run) draw from the same
+buckets instead of each keeping its own module-global timestamps.
+
+Keys are "domain:<host>" for outbound checks and "service:<name>" for
+rate-limited APIs. A key without its own entry falls back to its prefix
+("domain", "service:spn2", ...). Limits can be overridden with
+RATE_LIMITS, e.g. "domain=2:1,domain:tumblr.com=0.5:1,service:spn2=0.2:1"
+(tokens per second : burst).
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger("linkkeeper.ratelimit")
+
+# key -> (tokens per second, burst)
+DEFAULT_LIMITS = {
+    "domain": (2.0, 1),             # max 2 req/sec per domain
+    "service:spn2": (12 / 60, 1),   # SPN2: 12/min, below the 15/min cap
+    "service:spn2-status": (1.0, 2),  # SPN2 status polls, up to 50 jobs each
+    "service:cdx": (1.0, 4),        # CDX queries (cache misses only)
+}
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def parse_limits(spec):
+    """Parse a RATE_LIMITS string into {key: (rate, burst)}."""
+    limits = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        key, _, value = part.partition("=")
+        rate, _, burst = value.partition(":")
+        rate, burst = float(rate), int(burst or 1)
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"RATE_LIMITS entry {part!r}: rate must be > 0 and burst >= 1")
+        limits[key.strip()] = (rate, burst)
+    return limits
+
+
+class RateLimiter:
+    """Token buckets in SQLite (shared across processes) or in memory."""
+
+    def __init__(self, path=None, limits=None):
+        self.path = path
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self._local = threading.local()
+        self._memory = {}  # key -> (tokens, updated) when path is None
+        self._memory_lock = threading.Lock()
+
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = self._conn()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def limit_for(self, key):
+        """Return (rate, burst) for a key, falling back to its prefix."""
+        if key in self.limits:
+            return self.limits[key]
+        return self.limits.get(key.split(":", 1)[0])
+
+    def _take(self, key, consume):
+        """Refill the bucket and optionally take a token.
+
+        Returns 0.0 if a token is (or was) available, else the seconds
+        until one will be.
+        """
+        limit = self.limit_for(key)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        now = time.time()
+
+        if self.path is not None:
+            try:
+                return self._take_shared(key, consume, rate, burst, now)
+            except sqlite3.Error as e:
+                # e.g. "database is locked": keep going on this process's
+                # own buckets rather than failing the caller
+                logger.warning("Shared rate limit state for %s unavailable (%s), "
+                               "limiting in-process", key, e)
+
+        with self._memory_lock:
+            tokens, updated = self._memory.get(key, (burst, now))
+            wait, tokens = self._refill(tokens, updated, now, rate, burst, consume)
+            self._memory[key] = (tokens, now)
+        return wait
+
+    def _take_shared(self, key, consume, rate, burst, now):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (burst, now)
+            wait, tokens = self._refill(tokens, updated, now, rate, burst, consume)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    @staticmethod
+    def _refill(tokens, updated, now, rate, burst, consume):
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+        if tokens >= 1:
+            return 0.0, tokens - 1 if consume else tokens
+        return (1 - tokens) / rate, tokens
+
+    def next_available(self, key):
+        """Seconds until a token for key is available, without taking one."""
+        return self._take(key, consume=False)
+
+    def try_acquire(self, key):
+        """Take a token if one is available now.
+
+        Non-blocking: returns 0.0 on success, otherwise the seconds to wait
+        before trying again, so a caller can go and serve another key.
+        """
+        return self._take(key, consume=True)
+
+    def acquire(self, key):
+        """Block until a token for key has been taken."""
+        while True:
+            wait = self.try_acquire(key)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+def configure(config):
+    """Build the process-wide limiter from config (state file + overrides)."""
+    global _limiter
+    path = None
+    if config.get("state_dir"):
+        path = os.path.join(config["state_dir"], "ratelimit.sqlite3")
+    limits = parse_limits(config.get("rate_limits"))
+    try:
+        limiter = RateLimiter(path, limits)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Shared rate limit state unavailable (%s), using in-process buckets", e)
+        limiter = RateLimiter(None, limits)
+    with _limiter_lock:
+        _limiter = limiter
+    return _limiter
+
+
+def get_limiter():
+    """Return the process-wide limiter (in-memory until configure() is called)."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
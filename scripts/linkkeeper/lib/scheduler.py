@@ -0,0 +1,158 @@
+"""In-process job scheduler for `linkkeeper.py daemon`.
+
+Runs the same jobs as crontab, on the same schedule, from one long-lived
+process so imports, config, pooled DB connections and HTTP sessions stay
+warm between runs. Jobs never overlap: they run one at a time in due
+order. Each run gets a time budget that jobs honour cooperatively by
+checking out_of_time() between units of work, and SIGTERM sets the same
+flag so the current job stops at its next check and the daemon exits.
+"""
+
+import time
+import signal
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger("linkkeeper.scheduler")
+
+# (command, cron expression in UTC, time budget in seconds)
+SCHEDULE = [
+    ("process-queue", "*/5 * * * *", 4 * 60),
+    ("check-links", "0 * * * *", 50 * 60),
+    ("submit-archive", "30 */6 * * *", 2 * 3600),
+    ("poll-archive", "*/10 * * * *", 8 * 60),
+    ("snapshot-critical", "30 2 * * 0", 6 * 3600),
+    ("remediate-dead", "0 5 * * 1", 2 * 3600),
+    ("sync-externallinks", "0 1 1 * *", 6 * 3600),
+]
+
+_stop = threading.Event()
+_deadline = None  # time.monotonic() value the current job must finish by
+
+
+def out_of_time():
+    """True once the current job's budget is spent or shutdown was requested.
+
+    Always False outside the daemon, so one-shot CLI runs are unaffected.
+    """
+    if _stop.is_set():
+        return True
+    return _deadline is not None and time.monotonic() >= _deadline
+
+
+def request_stop(signum=None, frame=None):
+    """Ask the daemon to stop after the current unit of work."""
+    if not _stop.is_set():
+        logger.info("Shutdown requested, finishing current work")
+    _stop.set()
+
+
+class CronSpec:
+    """A five-field cron expression (minute hour day month weekday).
+
+    Supports *, */n, a-b, a-b/n, single values and comma lists. Weekday 0
+    is Sunday, as in crontab.
+    """
+
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expr):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected 5 cron fields, got {expr!r}")
+        self.expr = expr
+        self.minute, self.hour, self.day, self.month, self.weekday = (
+            self._parse(field, lo, hi) for field, (lo, hi) in zip(fields, self._RANGES)
+        )
+
+    @staticmethod
+    def _parse(field, lo, hi):
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/", 1)
+                step = int(step)
+            if part == "*":
+                start, end = lo, hi
+            elif "-" in part:
+                start, end = (int(x) for x in part.split("-", 1))
+            else:
+                start = end = int(part)
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches(self, dt):
+        return (
+            dt.minute in self.minute
+            and dt.hour in self.hour
+            and dt.day in self.day
+            and dt.month in self.month
+            and (dt.weekday() + 1) % 7 in self.weekday
+        )
+
+    def next_after(self, dt):
+        """Return the first whole minute strictly after dt that matches."""
+        candidate = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # A year of minutes covers every valid expression
+        for _ in range(366 * 24 * 60):
+            if self.matches(candidate):
+                return candidate
+            candidate += timedelta(minutes=1)
+        raise ValueError(f"Cron expression never matches: {self.expr!r}")
+
+
+class Scheduler:
+    """Run jobs one at a time whenever their cron expression comes due."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def add(self, name, cron, budget, func):
+        now = datetime.now(timezone.utc)
+        spec = CronSpec(cron)
+        self.jobs.append({
+            "name": name,
+            "spec": spec,
+            "budget": budget,
+            "func": func,
+            "next": spec.next_after(now),
+        })
+
+    def run_forever(self):
+        """Block until SIGTERM/SIGINT, running due jobs in order."""
+        global _deadline
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        for job in self.jobs:
+            logger.info("Scheduled %s (%s), next run %s",
+                        job["name"], job["spec"].expr, job["next"].isoformat())
+
+        while not _stop.is_set():
+            now = datetime.now(timezone.utc)
+            due = sorted((j for j in self.jobs if j["next"] <= now), key=lambda j: j["next"])
+
+            if not due:
+                wake = min(j["next"] for j in self.jobs)
+                _stop.wait(max(1.0, (wake - now).total_seconds()))
+                continue
+
+            job = due[0]
+            started = time.monotonic()
+            _deadline = started + job["budget"]
+            logger.info("Starting %s (budget %ds)", job["name"], job["budget"])
+            try:
+                job["func"]()
+            except Exception:
+                logger.exception("Job %s failed", job["name"])
+            finally:
+                _deadline = None
+
+            logger.info("Finished %s in %.1fs", job["name"], time.monotonic() - started)
+            # Runs missed while this or another job was busy collapse into one
+            job["next"] = job["spec"].next_after(datetime.now(timezone.utc))
+
+        logger.info("Scheduler stopped")
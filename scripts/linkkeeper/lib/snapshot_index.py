@@ -0,0 +1,171 @@
+"""Local index of Wayback snapshots, filled by domain-wide CDX prefetches.
+
+Most archived links cluster on a handful of domains, so instead of one
+CDX request per URL, prefetch_domains() pages through each busy domain's
+captures once and stores the latest capture per URL in a SQLite file
+under the state directory. lookup() then answers from that index, and
+says whether a miss is authoritative (the domain was fully listed
+recently) or whether the caller should fall back to cdx_lookup().
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from urllib.parse import urlparse
+
+import requests
+
+from .url_normalize import normalize_url
+from .wayback import cdx_domain_pages
+
+logger = logging.getLogger("linkkeeper.snapshot_index")
+
+PREFETCH_MIN_URLS = 3          # only prefetch domains with this many URLs pending
+PREFETCH_MAX_AGE = 7 * 86400   # seconds before a domain listing is refreshed
+PREFETCH_MAX_PAGES = 20        # CDX pages per domain before giving up (partial)
+
+# lookup() results
+HIT = "hit"
+MISS = "miss"          # domain fully listed recently, so no snapshot exists
+UNKNOWN = "unknown"    # not covered by the index, ask CDX directly
+
+
+def snapshot_key(url):
+    """Index key for a URL: normalized, without scheme or leading www."""
+    normalized = normalize_url(url)
+    if not normalized:
+        return ""
+    parsed = urlparse(normalized)
+    host = parsed.netloc
+    if host.startswith("www."):
+        host = host[4:]
+    key = host + (parsed.path or "/")
+    if parsed.query:
+        key += "?" + parsed.query
+    return key
+
+
+class SnapshotIndex:
+    """SQLite-backed map of URL key -> latest known Wayback capture."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                key TEXT PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                wayback_url TEXT NOT NULL,
+                status TEXT
+            );
+            CREATE TABLE IF NOT EXISTS domains (
+                domain TEXT PRIMARY KEY,
+                fetched REAL NOT NULL,
+                complete INTEGER NOT NULL
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def add_many(self, captures):
+        """Store 2xx captures, keeping the newest timestamp per URL key."""
+        rows = [
+            (snapshot_key(c["original"]), c["timestamp"], c["wayback_url"], c["status"])
+            for c in captures
+            if c.get("original") and c.get("timestamp") and _is_ok(c.get("status"))
+        ]
+        with self._conn() as conn:
+            conn.executemany("""
+                INSERT INTO snapshots (key, timestamp, wayback_url, status)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    timestamp = excluded.timestamp,
+                    wayback_url = excluded.wayback_url,
+                    status = excluded.status
+                WHERE excluded.timestamp > snapshots.timestamp
+            """, [r for r in rows if r[0]])
+
+    def mark_domain(self, domain, complete):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO domains (domain, fetched, complete) VALUES (?, ?, ?)",
+                (domain, time.time(), 1 if complete else 0),
+            )
+
+    def domain_state(self, domain):
+        """Return (fetched_at, complete) for a domain, or None."""
+        return self._conn().execute(
+            "SELECT fetched, complete FROM domains WHERE domain = ?", (domain,)
+        ).fetchone()
+
+    def is_fresh(self, domain):
+        state = self.domain_state(domain)
+        return bool(state) and time.time() - state[0] < PREFETCH_MAX_AGE
+
+    def lookup(self, url, domain):
+        """Return (HIT, snapshot), (MISS, None) or (UNKNOWN, None)."""
+        row = self._conn().execute(
+            "SELECT timestamp, wayback_url, status FROM snapshots WHERE key = ?",
+            (snapshot_key(url),),
+        ).fetchone()
+        if row and _is_ok(row[2]):
+            return HIT, {"timestamp": row[0], "wayback_url": row[1], "status": row[2]}
+        if row:
+            # Stored by an older, unfiltered listing; a good capture may
+            # still exist behind it
+            return UNKNOWN, None
+        state = self.domain_state(domain)
+        if state and state[1] and time.time() - state[0] < PREFETCH_MAX_AGE:
+            return MISS, None
+        return UNKNOWN, None
+
+    def prefetch_domains(self, domains):
+        """List each stale domain from CDX into the index. Returns captures stored."""
+        stored = 0
+        for domain in domains:
+            if self.is_fresh(domain):
+                continue
+            complete = False
+            pages = 0
+            try:
+                for page in cdx_domain_pages(domain):
+                    self.add_many(page)
+                    stored += len(page)
+                    pages += 1
+                    if pages >= PREFETCH_MAX_PAGES:
+                        logger.info("CDX prefetch for %s stopped after %d pages", domain, pages)
+                        break
+                else:
+                    complete = True
+            except (requests.RequestException, ValueError) as e:
+                logger.warning("CDX prefetch failed for %s: %s", domain, e)
+            self.mark_domain(domain, complete)
+            logger.info("CDX prefetch %s: %d pages (%s)",
+                        domain, pages, "complete" if complete else "partial")
+        return stored
+
+
+def _is_ok(status):
+    return str(status or "").startswith("2")
+
+
+def open_snapshot_index(config):
+    """Open the index under config["state_dir"], or None if unavailable."""
+    state_dir = config.get("state_dir")
+    if not state_dir:
+        return None
+    try:
+        return SnapshotIndex(os.path.join(state_dir, "snapshots.sqlite3"))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Snapshot index unavailable: %s", e)
+        return None
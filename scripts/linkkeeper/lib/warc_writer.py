@@ -1,101 +1,344 @@
-"""WARC file generation for local snapshots of critical pages."""
+"""WARC file generation for local snapshots of critical pages.
+
+Responses are streamed into a spooled temporary buffer (in memory up to
+SPOOL_MEMORY, then on disk) while their WARC digests are computed, so a
+capture uses constant memory however large the page is. Bodies beyond
+max_bytes are cut off and the record is marked WARC-Truncated: length.
+
+A snapshot run appends many captures to one RollingWARCFile per domain,
+each record its own gzip member so it can be fetched by offset and
+length. The file can be written locally or streamed to R2, and comes
+with a sidecar CDXJ index mapping SURT URL and timestamp to the
+record's offset and length.
+
+If the caller passes the payload digest of the previous snapshot and the
+new payload matches it, a small revisit record (identical-payload-digest
+profile) is written instead of the full response.
+"""
 
 import io
 import os
+import json
+import base64
+import shutil
+import hashlib
 import tempfile
 import logging
 from datetime import datetime, timezone
+from urllib.parse import urlsplit
 
 import requests
 from warcio.warcwriter import WARCWriter
 from warcio.statusandheaders import StatusAndHeaders
 
+from .http_check import get_session
+
 logger = logging.getLogger("linkkeeper.warc")
 
-USER_AGENT = (
-    "LinkKeeper/1.0 (https://flowarts.wiki; link preservation bot) "
-    "Mozilla/5.0 (compatible)"
-)
+MAX_CAPTURE_BYTES = 100 * 1024 * 1024  # default payload cap per capture
+SPOOL_MEMORY = 1024 * 1024             # buffer in memory up to this, then disk
+CHUNK_SIZE = 64 * 1024
+ROLL_SIZE = 256 * 1024 * 1024          # start a new WARC file past this size
+RECORD_SPOOL = 8 * 1024 * 1024         # a finished gzip record stays in memory up to this
+
+
+def warc_filename(prefix):
+    """Name for a new WARC file: linkkeeper-<prefix>-<timestamp>.warc.gz."""
+    ts = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    safe_prefix = prefix.replace("://", "_").replace("/", "_")[:80]
+    return f"linkkeeper-{safe_prefix}-{ts}.warc.gz"
+
+
+class RollingWARCFile:
+    """One .warc.gz being appended to, plus the CDXJ entries for it.
+
+    out is any binary stream with write() and close(): a local file or an
+    r2_client.MultipartUpload. Each record is built in a spooled buffer
+    first and only appended once complete, so a failed capture leaves
+    nothing behind and out never needs to seek. Use add(url) per capture,
+    close() when done (or once size passes ROLL_SIZE), then index() for
+    the sidecar CDXJ text.
+    """
+
+    def __init__(self, out, filename):
+        self.out = out
+        self.filename = filename
+        self.size = 0
+        self.entries = []  # one dict per response/revisit record, see add()
+        self._append(_write_warcinfo)
+
+    @property
+    def responses(self):
+        """Number of full response records (not revisits) in the file."""
+        return sum(1 for entry in self.entries if not entry["revisit"])
 
+    def _append(self, write_record, *args):
+        """Build one gzip member with write_record(writer, *args) and append it.
 
-def capture_url_to_warc(url, output_dir=None):
-    """Fetch a URL and write it to a WARC file.
+        Returns (write_record's result, offset, length).
+        """
+        with tempfile.SpooledTemporaryFile(max_size=RECORD_SPOOL) as buf:
+            info = write_record(WARCWriter(buf, gzip=True), *args)
+            length = buf.tell()
+            buf.seek(0)
+            shutil.copyfileobj(buf, self.out, CHUNK_SIZE)
+        offset = self.size
+        self.size += length
+        return info, offset, length
+
+    def add(self, url, max_bytes=MAX_CAPTURE_BYTES, previous=None):
+        """Fetch url and append it as a response (or revisit) record.
+
+        previous is {"digest", "timestamp"} of the last stored snapshot,
+        if any; a matching payload is written as a revisit record.
+
+        Returns dict with:
+            success: bool
+            offset, length: position of the record in the file
+            timestamp: capture time (YYYYMMDDHHmmss)
+            truncated: True if the payload was cut off at max_bytes
+            revisit: True if the payload matched previous
+            payload_digest: WARC-Payload-Digest of the stored payload
+            error: error message if failed
+        """
+        result = {"success": False, "offset": None, "length": 0, "timestamp": None,
+                  "truncated": False, "revisit": False, "payload_digest": None,
+                  "error": None}
+
+        try:
+            info, offset, length = self._append(_write_response, url, max_bytes, previous)
+        except requests.RequestException as e:
+            result["error"] = f"HTTP error: {e}"
+            logger.error("WARC capture failed for %s: %s", url, e)
+            return result
+        except Exception as e:
+            result["error"] = str(e)
+            logger.error("WARC write failed for %s: %s", url, e)
+            return result
+
+        result.update(info, success=True, offset=offset, length=length)
+        self.entries.append({
+            "url": url,
+            "timestamp": info["timestamp"],
+            "status": info["status"],
+            "mime": "warc/revisit" if info["revisit"] else info["mime"],
+            "digest": info["payload_digest"],
+            "revisit": info["revisit"],
+            "offset": offset,
+            "length": length,
+        })
+        return result
+
+    def close(self):
+        """Finish the WARC file (for an upload stream, completes the upload)."""
+        self.out.close()
+        logger.info("WARC file closed: %s (%d records, %d bytes)",
+                    self.filename, len(self.entries), self.size)
+
+    def index(self):
+        """Sidecar CDXJ index for the records written, sorted."""
+        lines = sorted(_cdxj_line(entry, self.filename) for entry in self.entries)
+        return "".join(line + "\n" for line in lines)
+
+
+def capture_url_to_warc(url, output_dir=None, max_bytes=MAX_CAPTURE_BYTES):
+    """Fetch a URL and write it to a WARC file of its own.
 
     Returns dict with:
         success: bool
         path: path to WARC file
         size: file size in bytes
+        truncated: True if the payload was cut off at max_bytes
+        payload_digest: WARC-Payload-Digest of the stored payload
         error: error message if failed
     """
-    result = {"success": False, "path": None, "size": 0, "error": None}
-
     if output_dir is None:
         output_dir = tempfile.gettempdir()
 
     os.makedirs(output_dir, exist_ok=True)
-
-    ts = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
-    safe_url = url.replace("://", "_").replace("/", "_")[:80]
-    filename = f"linkkeeper-{safe_url}-{ts}.warc.gz"
+    filename = warc_filename(url)
     filepath = os.path.join(output_dir, filename)
 
-    try:
-        resp = requests.get(
-            url,
-            headers={"User-Agent": USER_AGENT},
-            timeout=30,
-            stream=True,
+    with open(filepath, "wb") as out:
+        try:
+            warc = RollingWARCFile(out, filename)
+            record = warc.add(url, max_bytes)
+            warc.close()
+        except BaseException:
+            out.close()
+            os.remove(filepath)
+            raise
+
+    result = {
+        "success": record["success"],
+        "path": filepath if record["success"] else None,
+        "size": warc.size,
+        "truncated": record["truncated"],
+        "payload_digest": record["payload_digest"],
+        "error": record["error"],
+    }
+    if record["success"]:
+        logger.info("WARC captured: %s -> %s (%d bytes)", url, filepath, result["size"])
+    else:
+        os.remove(filepath)
+    return result
+
+
+def _write_warcinfo(writer):
+    info_payload = (
+        f"software: LinkKeeper/1.0\r\n"
+        f"description: Flow Arts Wiki link preservation snapshot\r\n"
+        f"operator: flowarts.wiki\r\n"
+    ).encode("utf-8")
+    info_record = writer.create_warc_record(
+        uri=None,
+        record_type="warcinfo",
+        warc_content_type="application/warc-fields",
+        payload=io.BytesIO(info_payload),
+        length=len(info_payload),
+    )
+    writer.write_record(info_record)
+
+
+def _write_response(writer, url, max_bytes, previous=None):
+    """Fetch url and write its response record; returns capture details.
+
+    Writes a revisit record instead when the payload digest equals
+    previous["digest"].
+    """
+    now = datetime.now(timezone.utc)
+    resp = get_session(url).get(
+        url,
+        timeout=30,
+        stream=True,
+    )
+
+    with resp:
+        # Build HTTP status line and headers. The body is stored as
+        # received but de-chunked, so Transfer-Encoding no longer applies.
+        status_line = f"{resp.status_code} {resp.reason}"
+        headers_list = [
+            (name, value) for name, value in resp.headers.items()
+            if name.lower() != "transfer-encoding"
+        ]
+        http_headers = StatusAndHeaders(
+            status_line, headers_list, protocol="HTTP/1.1"
         )
 
-        with open(filepath, "wb") as fh:
-            writer = WARCWriter(fh, gzip=True)
-
-            # Write warcinfo record
-            info_payload = (
-                f"software: LinkKeeper/1.0\r\n"
-                f"description: Flow Arts Wiki link preservation snapshot\r\n"
-                f"operator: flowarts.wiki\r\n"
-            ).encode("utf-8")
-            info_record = writer.create_warc_record(
-                uri=None,
-                record_type="warcinfo",
-                warc_content_type="application/warc-fields",
-                payload=io.BytesIO(info_payload),
-                length=len(info_payload),
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY) as payload:
+            length, truncated, digests = _spool_body(
+                resp, payload, http_headers.to_bytes(), max_bytes
             )
-            writer.write_record(info_record)
+            payload.seek(0)
+            warc_date = now.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-            # Build HTTP status line and headers
-            status_line = f"{resp.status_code} {resp.reason}"
-            headers_list = list(resp.headers.items())
-            http_headers = StatusAndHeaders(
-                status_line, headers_list, protocol="HTTP/1.1"
+            revisit = bool(
+                previous and not truncated
+                and previous.get("digest") == digests[0]
             )
+            if revisit:
+                # Unchanged since the last snapshot: headers only
+                revisit_record = writer.create_revisit_record(
+                    url,
+                    digest=digests[0],
+                    refers_to_uri=url,
+                    refers_to_date=_warc_date(previous.get("timestamp")),
+                    http_headers=http_headers,
+                    warc_headers_dict={"WARC-Date": warc_date},
+                )
+                writer.write_record(revisit_record)
+            else:
+                warc_headers = {
+                    "WARC-Date": warc_date,
+                    "WARC-Payload-Digest": digests[0],
+                    "WARC-Block-Digest": digests[1],
+                }
+                if truncated:
+                    warc_headers["WARC-Truncated"] = "length"
+                    logger.warning("Truncated capture of %s at %d bytes", url, length)
 
-            # Read full response body
-            body = resp.content
-            payload_stream = io.BytesIO(body)
-
-            # Write response record
-            response_record = writer.create_warc_record(
-                uri=url,
-                record_type="response",
-                http_headers=http_headers,
-                payload=payload_stream,
-                length=len(body),
-            )
-            writer.write_record(response_record)
+                # Write response record
+                response_record = writer.create_warc_record(
+                    uri=url,
+                    record_type="response",
+                    http_headers=http_headers,
+                    payload=payload,
+                    length=length,
+                    warc_headers_dict=warc_headers,
+                )
+                writer.write_record(response_record)
 
-        result["success"] = True
-        result["path"] = filepath
-        result["size"] = os.path.getsize(filepath)
-        logger.info("WARC captured: %s -> %s (%d bytes)", url, filepath, result["size"])
+    return {
+        "timestamp": now.strftime("%Y%m%d%H%M%S"),
+        "status": resp.status_code,
+        "mime": resp.headers.get("Content-Type", "").split(";")[0].strip(),
+        "truncated": truncated,
+        "revisit": revisit,
+        "payload_digest": digests[0],
+    }
 
-    except requests.RequestException as e:
-        result["error"] = f"HTTP error: {e}"
-        logger.error("WARC capture failed for %s: %s", url, e)
-    except Exception as e:
-        result["error"] = str(e)
-        logger.error("WARC write failed for %s: %s", url, e)
 
-    return result
+def _spool_body(resp, out, header_bytes, max_bytes):
+    """Copy the raw response body to out, hashing as it goes.
+
+    Stops after max_bytes. Returns (length, truncated, (payload_digest,
+    block_digest)) with digests in WARC "sha1:<base32>" form; the block
+    digest covers the serialized HTTP headers plus the payload.
+    """
+    payload_sha = hashlib.sha1()
+    block_sha = hashlib.sha1(header_bytes)
+    length = 0
+    truncated = False
+
+    # decode_content=False keeps any Content-Encoding, matching the headers
+    for chunk in resp.raw.stream(CHUNK_SIZE, decode_content=False):
+        if max_bytes is not None and length + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - length]
+            truncated = True
+        out.write(chunk)
+        payload_sha.update(chunk)
+        block_sha.update(chunk)
+        length += len(chunk)
+        if truncated:
+            break
+
+    return length, truncated, (_warc_digest(payload_sha), _warc_digest(block_sha))
+
+
+def _warc_digest(sha):
+    return "sha1:" + base64.b32encode(sha.digest()).decode("ascii")
+
+
+def _warc_date(ts):
+    """YYYYMMDDHHmmss -> WARC-Date (ISO 8601), or None."""
+    if not ts or len(ts) < 14:
+        return None
+    return f"{ts[0:4]}-{ts[4:6]}-{ts[6:8]}T{ts[8:10]}:{ts[10:12]}:{ts[12:14]}Z"
+
+
+def surt(url):
+    """Sort-friendly URL key as used by CDX(J): com,example)/path?query."""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    key = ",".join(reversed(host.split("."))) + ")"
+    if parts.port and parts.port not in (80, 443):
+        key = key[:-1] + f":{parts.port})"
+    key += (parts.path or "/").lower()
+    if parts.query:
+        key += "?" + "&".join(sorted(parts.query.lower().split("&")))
+    return key
+
+
+def _cdxj_line(entry, filename):
+    fields = {
+        "url": entry["url"],
+        "mime": entry["mime"],
+        "status": str(entry["status"]),
+        "digest": entry["digest"],
+        "length": str(entry["length"]),
+        "offset": str(entry["offset"]),
+        "filename": filename,
+    }
+    return f"{surt(entry['url'])} {entry['timestamp']} {json.dumps(fields)}"
@@ -1,36 +1,58 @@
 """Internet Archive Wayback Machine CDX API + SPN2 client."""
 
-import time
 import logging
 
 import requests
 
+from .http_check import get_session
+from .lookup_cache import get_lookup_cache
+from .ratelimit import get_limiter
+
 logger = logging.getLogger("linkkeeper.wayback")
 
 CDX_API = "https://web.archive.org/cdx/search/cdx"
 SPN2_API = "https://web.archive.org/save"
+SPN2_STATUS_API = "https://web.archive.org/save/status"
 AVAILABILITY_API = "https://archive.org/wayback/available"
 
-# SPN2 rate limit: 12/min (below the 15/min cap)
-_SPN2_MIN_INTERVAL = 5.0  # seconds between SPN2 submissions
-_last_spn2 = 0.0
+# SPN2 submissions are paced by the shared "service:spn2" bucket
+# (12/min by default, below the 15/min cap) and status polls by
+# "service:spn2-status"; CDX queries share "service:cdx". See
+# lib/ratelimit.py.
 
 
-def cdx_lookup(url, limit=1):
+def cdx_lookup(url, limit=1, refresh=False, before=None):
     """Look up a URL in the Wayback Machine CDX index.
 
-    Returns the most recent snapshot info or None.
+    Returns the most recent HTTP 200 snapshot info or None; error and
+    redirect captures are never returned. With before (YYYYMMDDhhmmss),
+    only captures up to that time count. Single-result lookups without
+    before go through the lookup cache; refresh=True skips the cached
+    answer.
     """
+    cache = get_lookup_cache() if limit == 1 and before is None else None
+    if cache and not refresh:
+        hit, snapshot = cache.get("cdx", url)
+        # Entries cached before lookups were limited to 200s may not be
+        if hit and (snapshot is None or snapshot.get("status") == "200"):
+            return snapshot
+
+    params = {
+        "url": url,
+        "output": "json",
+        "limit": limit,
+        "fl": "timestamp,original,statuscode,mimetype",
+        "filter": "statuscode:200",
+        "sort": "reverse",
+    }
+    if before:
+        params["to"] = before
+
+    get_limiter().acquire("service:cdx")
     try:
-        resp = requests.get(
+        resp = get_session(CDX_API).get(
             CDX_API,
-            params={
-                "url": url,
-                "output": "json",
-                "limit": limit,
-                "fl": "timestamp,original,statuscode,mimetype",
-                "sort": "reverse",
-            },
+            params=params,
             timeout=15,
         )
         if resp.status_code != 200:
@@ -38,27 +60,93 @@ def cdx_lookup(url, limit=1):
             return None
 
         rows = resp.json()
-        if len(rows) < 2:  # first row is header
-            return None
+    except requests.RequestException as e:
+        logger.warning("CDX lookup error for %s: %s", url, e)
+        return None
 
+    snapshot = None
+    if len(rows) >= 2:  # first row is header
         header, row = rows[0], rows[1]
         result = dict(zip(header, row))
         ts = result.get("timestamp", "")
         original = result.get("original", url)
-        return {
+        snapshot = {
             "timestamp": ts,
             "wayback_url": f"https://web.archive.org/web/{ts}/{original}",
             "status": result.get("statuscode", ""),
         }
-    except requests.RequestException as e:
-        logger.warning("CDX lookup error for %s: %s", url, e)
-        return None
+    if cache:
+        cache.put("cdx", url, snapshot)
+    return snapshot
+
 
+def cdx_domain_pages(domain, page_size=5000):
+    """Yield every capture under a domain from CDX, one page at a time.
+
+    Uses matchType=domain with only HTTP 200 captures, collapsed by
+    urlkey (so the newest good capture per URL), following the resume key
+    between pages. Each page is a list of snapshot dicts like cdx_lookup
+    returns, plus "original". Raises requests.RequestException (or
+    ValueError on a malformed response) if a page cannot be fetched, so the
+    caller can tell a complete listing from a partial one.
+    """
+    resume_key = None
+    while True:
+        params = {
+            "url": domain,
+            "matchType": "domain",
+            "filter": "statuscode:200",
+            "collapse": "urlkey",
+            "output": "json",
+            "fl": "timestamp,original,statuscode",
+            "sort": "reverse",
+            "limit": page_size,
+            "showResumeKey": "true",
+        }
+        if resume_key:
+            params["resumeKey"] = resume_key
+
+        get_limiter().acquire("service:cdx")
+        resp = get_session(CDX_API).get(CDX_API, params=params, timeout=60)
+        resp.raise_for_status()
+        rows = resp.json() if resp.content.strip() else []
+
+        # Layout: header, captures..., then [] and [resume_key] if more remain
+        resume_key = None
+        if len(rows) >= 2 and rows[-2] == [] and len(rows[-1]) == 1:
+            resume_key = rows[-1][0]
+            rows = rows[:-2]
+
+        page = []
+        if rows:
+            header = rows[0]
+            for row in rows[1:]:
+                capture = dict(zip(header, row))
+                ts = capture.get("timestamp", "")
+                original = capture.get("original", "")
+                page.append({
+                    "original": original,
+                    "timestamp": ts,
+                    "wayback_url": f"https://web.archive.org/web/{ts}/{original}",
+                    "status": capture.get("statuscode", ""),
+                })
+        if page:
+            yield page
+
+        if not resume_key:
+            return
+
+
+def check_availability(url, refresh=False):
+    """Quick availability check via Wayback Availability API (cached)."""
+    cache = get_lookup_cache()
+    if not refresh:
+        hit, snapshot = cache.get("availability", url)
+        if hit:
+            return snapshot
 
-def check_availability(url):
-    """Quick availability check via Wayback Availability API."""
     try:
-        resp = requests.get(
+        resp = get_session(AVAILABILITY_API).get(
             AVAILABILITY_API,
             params={"url": url},
             timeout=10,
@@ -66,18 +154,22 @@ def check_availability(url):
         if resp.status_code != 200:
             return None
         data = resp.json()
-        snapshot = data.get("archived_snapshots", {}).get("closest")
-        if snapshot and snapshot.get("available"):
-            return {
-                "timestamp": snapshot.get("timestamp", ""),
-                "wayback_url": snapshot.get("url", ""),
-                "status": snapshot.get("status", ""),
-            }
-        return None
     except requests.RequestException as e:
         logger.warning("Availability check error for %s: %s", url, e)
         return None
 
+    snapshot = data.get("archived_snapshots", {}).get("closest")
+    if snapshot and snapshot.get("available"):
+        snapshot = {
+            "timestamp": snapshot.get("timestamp", ""),
+            "wayback_url": snapshot.get("url", ""),
+            "status": snapshot.get("status", ""),
+        }
+    else:
+        snapshot = None
+    cache.put("availability", url, snapshot)
+    return snapshot
+
 
 def submit_spn2(url, access_key, secret_key):
     """Submit a URL to Save Page Now 2 (SPN2).
@@ -87,15 +179,12 @@ def submit_spn2(url, access_key, secret_key):
         job_id: SPN2 job ID if submitted
         error: error message if failed
     """
-    global _last_spn2
-    elapsed = time.monotonic() - _last_spn2
-    if elapsed < _SPN2_MIN_INTERVAL:
-        time.sleep(_SPN2_MIN_INTERVAL - elapsed)
+    get_limiter().acquire("service:spn2")
 
     result = {"success": False, "job_id": None, "error": None}
 
     try:
-        resp = requests.post(
+        resp = get_session(SPN2_API).post(
             SPN2_API,
             data={"url": url, "capture_all": 1},
             headers={
@@ -104,8 +193,6 @@ def submit_spn2(url, access_key, secret_key):
             },
             timeout=30,
         )
-        _last_spn2 = time.monotonic()
-
         if resp.status_code == 200:
             data = resp.json()
             result["success"] = True
@@ -118,8 +205,41 @@ def submit_spn2(url, access_key, secret_key):
             logger.warning("SPN2 error for %s: %s", url, result["error"])
 
     except requests.RequestException as e:
-        _last_spn2 = time.monotonic()
         result["error"] = str(e)
         logger.warning("SPN2 request error for %s: %s", url, e)
 
     return result
+
+
+def spn2_status(job_ids, access_key, secret_key):
+    """Fetch the status of several SPN2 jobs in one request.
+
+    Returns {job_id: status dict} as reported by SPN2, where "status" is
+    "pending", "success" (with "timestamp" and "original_url") or "error"
+    (with "status_ext"/"message"). Jobs missing from the reply, or all of
+    them if the request fails, are left out so the caller polls again.
+    """
+    get_limiter().acquire("service:spn2-status")
+
+    try:
+        resp = get_session(SPN2_STATUS_API).post(
+            SPN2_STATUS_API,
+            data={"job_ids": ",".join(job_ids)},
+            headers={
+                "Authorization": f"LOW {access_key}:{secret_key}",
+                "Accept": "application/json",
+            },
+            timeout=30,
+        )
+        if resp.status_code != 200:
+            logger.warning("SPN2 status HTTP %d for %d jobs", resp.status_code, len(job_ids))
+            return {}
+        data = resp.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning("SPN2 status request error: %s", e)
+        return {}
+
+    # A single job comes back as an object, several as a list
+    if isinstance(data, dict):
+        data = [data]
+    return {item["job_id"]: item for item in data if isinstance(item, dict) and item.get("job_id")}
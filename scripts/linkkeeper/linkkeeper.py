@@ -3,12 +3,16 @@
 
 Usage:
     linkkeeper.py process-queue [--batch N]
-    linkkeeper.py check-links [--batch N]
-    linkkeeper.py submit-archive [--batch N] [--dry-run]
-    linkkeeper.py snapshot-critical [--domain DOMAIN] [--limit N]
-    linkkeeper.py remediate-dead [--dry-run]
+    linkkeeper.py check-links [--batch N] [--concurrency N]
+    linkkeeper.py submit-archive [--batch N] [--concurrency N] [--dry-run] [--refresh]
+    linkkeeper.py poll-archive [--batch N] [--concurrency N]
+    linkkeeper.py snapshot-critical [--domain DOMAIN] [--limit N] [--concurrency N]
+    linkkeeper.py remediate-dead [--dry-run] [--refresh]
     linkkeeper.py sync-externallinks
+    linkkeeper.py migrate-page-ids
+    linkkeeper.py lookup URL | --rebuild
     linkkeeper.py status
+    linkkeeper.py daemon
 """
 
 import sys
@@ -39,25 +43,32 @@ def cmd_process_queue(args, config):
 
 def cmd_check_links(args, config):
     from jobs.check_links import run
-    count = run(config, batch=args.batch)
+    count = run(config, batch=args.batch, concurrency=args.concurrency)
     print(f"Checked {count} URLs")
 
 
 def cmd_submit_archive(args, config):
     from jobs.submit_archive import run
-    count = run(config, batch=args.batch, dry_run=args.dry_run)
+    count = run(config, batch=args.batch, dry_run=args.dry_run,
+                refresh=args.refresh, concurrency=args.concurrency)
     print(f"Processed {count} URLs for archival")
 
 
+def cmd_poll_archive(args, config):
+    from jobs.poll_archive import run
+    count = run(config, batch=args.batch, concurrency=args.concurrency)
+    print(f"Resolved {count} pending SPN2 captures")
+
+
 def cmd_snapshot_critical(args, config):
     from jobs.snapshot_critical import run
-    count = run(config, domain=args.domain, limit=args.limit)
+    count = run(config, domain=args.domain, limit=args.limit, concurrency=args.concurrency)
     print(f"Captured {count} WARC snapshots")
 
 
 def cmd_remediate_dead(args, config):
     from jobs.remediate_dead import run
-    count = run(config, dry_run=args.dry_run)
+    count = run(config, dry_run=args.dry_run, refresh=args.refresh)
     print(f"Remediated/flagged {count} dead links")
 
 
@@ -67,35 +78,95 @@ def cmd_sync_externallinks(args, config):
     print(f"Synced {count} URLs from externallinks")
 
 
-def cmd_status(args, config):
-    from lib.db import get_connection, execute_one
-    conn = get_connection(config)
+def cmd_migrate_page_ids(args, config):
+    from jobs.migrate_page_ids import run
+    count = run(config)
+    print(f"Migrated {count} page links into faw_link_page")
+
+
+def cmd_lookup(args, config):
+    from lib.cdxj_index import open_cdxj_index
+    index = open_cdxj_index(config)
+    if not index:
+        print("CDXJ index unavailable (set LINKKEEPER_STATE_DIR)")
+        sys.exit(1)
+
+    if args.rebuild:
+        from lib.r2_client import get_r2_client, iter_warcs, fetch_object
+        count = index.rebuild(get_r2_client(config), config["r2_bucket"], iter_warcs, fetch_object)
+        print(f"Rebuilt CDXJ index with {count} records")
+        return
 
-    total = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive")
-    dead = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive WHERE la_is_dead = 1")
-    archived = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive WHERE la_wayback_url IS NOT NULL")
-    snapshotted = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive WHERE la_r2_key IS NOT NULL")
-    remediated = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive WHERE la_remediated = 1")
-    queued = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_queue")
+    if not args.url:
+        print("Usage: linkkeeper.py lookup URL | --rebuild")
+        sys.exit(1)
+
+    record = index.lookup(args.url)
+    if not record:
+        print(f"No WARC snapshot of {args.url}")
+        sys.exit(1)
 
-    def val(row):
-        return row.get("c", row.get(b"c", 0))
+    offset, length = int(record["offset"]), int(record["length"])
+    print(f"bucket:    {config['r2_bucket']}")
+    print(f"key:       {record['key']}")
+    print(f"offset:    {offset}")
+    print(f"length:    {length}")
+    print(f"timestamp: {record['timestamp']}")
+    print(f"range:     bytes={offset}-{offset + length - 1}")
 
-    print(f"LinkKeeper Status")
-    print(f"  Total URLs:      {val(total)}")
-    print(f"  Dead:            {val(dead)}")
-    print(f"  Archived (IA):   {val(archived)}")
-    print(f"  Snapshotted (R2):{val(snapshotted)}")
-    print(f"  Remediated:      {val(remediated)}")
-    print(f"  Queue pending:   {val(queued)}")
 
-    # Top domains
-    domains = execute_one(conn, """
-        SELECT COUNT(DISTINCT la_domain) as c FROM faw_link_archive
-    """)
-    print(f"  Unique domains:  {val(domains)}")
+def cmd_status(args, config):
+    from lib.db import connection, execute_one
+    with connection(config) as conn:
+        total = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive")
+        dead = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive WHERE la_is_dead = 1")
+        archived = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive WHERE la_wayback_url IS NOT NULL")
+        snapshotted = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive WHERE la_r2_key IS NOT NULL")
+        remediated = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_archive WHERE la_remediated = 1")
+        queued = execute_one(conn, "SELECT COUNT(*) as c FROM faw_link_queue")
+
+        def val(row):
+            return row.get("c", row.get(b"c", 0))
+
+        print(f"LinkKeeper Status")
+        print(f"  Total URLs:      {val(total)}")
+        print(f"  Dead:            {val(dead)}")
+        print(f"  Archived (IA):   {val(archived)}")
+        print(f"  Snapshotted (R2):{val(snapshotted)}")
+        print(f"  Remediated:      {val(remediated)}")
+        print(f"  Queue pending:   {val(queued)}")
+
+        # Top domains
+        domains = execute_one(conn, """
+            SELECT COUNT(DISTINCT la_domain) as c FROM faw_link_archive
+        """)
+        print(f"  Unique domains:  {val(domains)}")
+
+
+def cmd_daemon(args, config):
+    from lib.scheduler import Scheduler, SCHEDULE
+    import jobs.process_queue
+    import jobs.check_links
+    import jobs.submit_archive
+    import jobs.poll_archive
+    import jobs.snapshot_critical
+    import jobs.remediate_dead
+    import jobs.sync_externallinks
+
+    runners = {
+        "process-queue": jobs.process_queue.run,
+        "check-links": jobs.check_links.run,
+        "submit-archive": jobs.submit_archive.run,
+        "poll-archive": jobs.poll_archive.run,
+        "snapshot-critical": jobs.snapshot_critical.run,
+        "remediate-dead": jobs.remediate_dead.run,
+        "sync-externallinks": jobs.sync_externallinks.run,
+    }
 
-    conn.close()
+    scheduler = Scheduler()
+    for name, cron, budget in SCHEDULE:
+        scheduler.add(name, cron, budget, lambda run=runners[name]: run(config))
+    scheduler.run_forever()
 
 
 def main():
@@ -108,21 +179,43 @@ def main():
     p_queue.add_argument("--batch", type=int, default=200)
 
     p_check = sub.add_parser("check-links", help="Run health checks")
-    p_check.add_argument("--batch", type=int, default=100)
+    p_check.add_argument("--batch", type=int, default=1000)
+    p_check.add_argument("--concurrency", type=int, default=8,
+                         help="Parallel checks (one in flight per domain)")
 
     p_archive = sub.add_parser("submit-archive", help="Submit to Internet Archive")
-    p_archive.add_argument("--batch", type=int, default=50)
+    p_archive.add_argument("--batch", type=int, default=500)
+    p_archive.add_argument("--concurrency", type=int, default=4,
+                           help="Parallel CDX lookups (SPN2 stays sequential)")
     p_archive.add_argument("--dry-run", action="store_true")
+    p_archive.add_argument("--refresh", action="store_true",
+                           help="Ignore cached Wayback lookups")
+
+    p_poll = sub.add_parser("poll-archive", help="Collect results of pending SPN2 captures")
+    p_poll.add_argument("--batch", type=int, default=1000)
+    p_poll.add_argument("--concurrency", type=int, default=4,
+                        help="Status requests in flight")
 
     p_snapshot = sub.add_parser("snapshot-critical", help="WARC snapshot critical domains")
     p_snapshot.add_argument("--domain", type=str, default=None)
     p_snapshot.add_argument("--limit", type=int, default=None)
+    p_snapshot.add_argument("--concurrency", type=int, default=4,
+                            help="Domains captured in parallel (one request in flight each)")
 
     p_remediate = sub.add_parser("remediate-dead", help="Remediate dead links")
     p_remediate.add_argument("--dry-run", action="store_true")
+    p_remediate.add_argument("--refresh", action="store_true",
+                             help="Ignore cached Wayback lookups")
 
     sub.add_parser("sync-externallinks", help="Full sync from MW externallinks")
+    sub.add_parser("migrate-page-ids", help="Copy legacy la_page_ids into faw_link_page")
+    p_lookup = sub.add_parser("lookup", help="Find our WARC record of a URL in R2")
+    p_lookup.add_argument("url", nargs="?")
+    p_lookup.add_argument("--rebuild", action="store_true",
+                          help="Rebuild the local index from the .cdxj files in R2")
+
     sub.add_parser("status", help="Show LinkKeeper status")
+    sub.add_parser("daemon", help="Run all jobs on schedule from one process")
 
     args = parser.parse_args()
     setup_logging(args.verbose)
@@ -133,14 +226,24 @@ def main():
 
     config = load_config()
 
+    from lib.ratelimit import configure as configure_rate_limits
+    configure_rate_limits(config)
+
+    from lib.lookup_cache import configure as configure_lookup_cache
+    configure_lookup_cache(config)
+
     commands = {
         "process-queue": cmd_process_queue,
         "check-links": cmd_check_links,
         "submit-archive": cmd_submit_archive,
+        "poll-archive": cmd_poll_archive,
         "snapshot-critical": cmd_snapshot_critical,
         "remediate-dead": cmd_remediate_dead,
         "sync-externallinks": cmd_sync_externallinks,
+        "migrate-page-ids": cmd_migrate_page_ids,
+        "lookup": cmd_lookup,
         "status": cmd_status,
+        "daemon": cmd_daemon,
     }
 
     commands[args.command](args, config)
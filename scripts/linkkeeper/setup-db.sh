@@ -2,30 +2,39 @@
 set -euo pipefail
 
 # LinkKeeper - One-time database setup
-# Creates faw_link_archive and faw_link_queue tables, then runs initial sync
+# Creates faw_link_archive, faw_link_page and faw_link_queue tables, copies
+# any legacy la_page_ids lists into faw_link_page, then runs initial sync
 # from MediaWiki's externallinks table.
 #
 # Usage: bash scripts/linkkeeper/setup-db.sh
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PROJECT_DIR="$(dirname "$(dirname "$SCRIPT_DIR")")"
-SQL_FILE="$PROJECT_DIR/extensions/LinkHealth/sql/tables.sql"
+SQL_DIR="$PROJECT_DIR/extensions/LinkHealth/sql"
 
 cd "$PROJECT_DIR"
 source .env
 
 echo "[$(date)] LinkKeeper: Setting up database tables..."
 
-# Replace MediaWiki placeholders with actual prefix (empty for this wiki)
-PROCESSED_SQL=$(sed \
-    -e 's|/\*_\*/||g' \
-    -e 's|/\*\$wgDBTableOptions\*/|ENGINE=InnoDB, DEFAULT CHARSET=binary|g' \
-    "$SQL_FILE")
+# tables.sql creates anything missing; patch-*.sql files bring existing
+# tables up to date and are written to be safe to re-run.
+for SQL_FILE in "$SQL_DIR/tables.sql" "$SQL_DIR"/patch-*.sql; do
+    [ -f "$SQL_FILE" ] || continue
 
-echo "$PROCESSED_SQL" | docker compose exec -T db mariadb \
-    --user="$DB_USER" \
-    --password="$DB_PASSWORD" \
-    "$DB_NAME"
+    # Replace MediaWiki placeholders with actual prefix (empty for this wiki)
+    PROCESSED_SQL=$(sed \
+        -e 's|/\*_\*/||g' \
+        -e 's|/\*\$wgDBTableOptions\*/|ENGINE=InnoDB, DEFAULT CHARSET=binary|g' \
+        "$SQL_FILE")
+
+    echo "$PROCESSED_SQL" | docker compose exec -T db mariadb \
+        --user="$DB_USER" \
+        --password="$DB_PASSWORD" \
+        "$DB_NAME"
+
+    echo "  Applied $(basename "$SQL_FILE")"
+done
 
 echo "  Tables created."
 
@@ -39,6 +48,10 @@ TABLES=$(docker compose exec -T db mariadb \
 echo "  Found tables:"
 echo "$TABLES"
 
+echo ""
+echo "[$(date)] Migrating legacy la_page_ids into faw_link_page..."
+docker compose exec linkkeeper python linkkeeper.py migrate-page-ids
+
 echo ""
 echo "[$(date)] Running initial sync from externallinks..."
 docker compose exec linkkeeper python linkkeeper.py sync-externallinks